@@ -12,15 +12,47 @@ Versão: 1.0 (VERSÃO DEFINITIVA)
 """
 
 import asyncio
+import base64
+import bisect
+import codecs
+import contextvars
+import itertools
 import json
 import logging
+import math
+import mmap
 import os
+import random
+import re
+import sqlite3
+import struct
+import threading
 import time
 import unicodedata
+from collections import OrderedDict
+from email.utils import mktime_tz, parsedate_tz
+import httpx
 import requests
+from array import array
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Set, Tuple
-from urllib.parse import urlencode
+from typing import Any, AsyncIterator, Coroutine, Dict, List, Optional, Set, Tuple, Union
+from urllib.parse import urlencode, urlsplit
+
+try:
+    import numpy as np
+except ImportError:  # NumPy é opcional (apenas VariaveisTable.to_numpy)
+    np = None
+
+# Bibliotecas JSON rápidas opcionais (ver JsonCodec)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
 
 try:
     from mcp.server.fastmcp import FastMCP
@@ -29,41 +61,1665 @@ except ImportError:
     print("💡 Execute: pip install mcp")
     exit(1)
 
-# Configurar logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Logging (configurado em configure_logging ao iniciar o servidor): nível,
+# formato ("texto" ou "json") e fração das requisições bem-sucedidas registradas
+LOG_LEVEL = os.getenv("IBGE_LOG_LEVEL", "WARNING").upper()
+LOG_FORMAT = os.getenv("IBGE_LOG_FORMAT", "texto").lower()
+LOG_SAMPLE_RATE = float(os.getenv("IBGE_LOG_SAMPLE_RATE", "1"))
+
 # Constantes da API do IBGE
 BASE_URL = "https://servicodados.ibge.gov.br/api/v3"
 MAX_VALUES_LIMIT = 100000
+# Teto de IDs explícitos por requisição ao dividir localidades (tamanho da URL)
+MAX_LOCALIDADES_PER_REQUEST = 200
+REQUEST_TIMEOUT = 30
+
+# Pool de conexões HTTP assíncrono (ajustável via variáveis de ambiente)
+MAX_CONNECTIONS = int(os.getenv("IBGE_MAX_CONNECTIONS", "20"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("IBGE_MAX_KEEPALIVE_CONNECTIONS", "10"))
+KEEPALIVE_EXPIRY = float(os.getenv("IBGE_KEEPALIVE_EXPIRY", "30"))
+MAX_CONCURRENCY_PER_HOST = int(os.getenv("IBGE_MAX_CONCURRENCY_PER_HOST", "8"))
+
+# Novas tentativas para falhas transitórias (timeouts, conexão, 429/5xx)
+RETRY_MAX_ATTEMPTS = max(1, int(os.getenv("IBGE_RETRY_ATTEMPTS", "3")))
+RETRY_BACKOFF_BASE = float(os.getenv("IBGE_RETRY_BACKOFF", "0.5"))
+RETRY_BACKOFF_MAX = 10.0
+# Teto para esperas pedidas pela API via Retry-After
+RETRY_AFTER_MAX = 60.0
+RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+
+# Disjuntor por classe de endpoint: falhas seguidas até abrir e pausa até testar de novo
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("IBGE_CIRCUIT_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("IBGE_CIRCUIT_RESET", "30"))
+
+# Limitador de taxa (token bucket): requisições/s e rajada máxima (0 desativa)
+RATE_LIMIT = float(os.getenv("IBGE_RATE_LIMIT", "10"))
+RATE_LIMIT_BURST = float(os.getenv("IBGE_RATE_LIMIT_BURST", "20"))
+# Limites adicionais por classe de endpoint, ex: "variaveis=4,metadados=8"
+RATE_LIMITS_BY_CLASS: Dict[str, float] = {
+    name.strip(): float(value)
+    for name, _, value in (
+        item.partition("=") for item in os.getenv("IBGE_RATE_LIMIT_BY_CLASS", "").split(",")
+    )
+    if name.strip() and value.strip()
+}
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'MCP-IBGE-Server/1.0',
+    'Accept': 'application/json'
+}
+
+# Porta opcional para expor métricas Prometheus via HTTP (0 desativa)
+METRICS_PORT = int(os.getenv("IBGE_METRICS_PORT", "0"))
+
+# Capacidade do cache em memória de metadados (MB, estimada pelo JSON compacto)
+METADATA_CACHE_BYTES = int(float(os.getenv("IBGE_METADATA_CACHE_MB", "64")) * 1024 * 1024)
+
+# Intervalo (segundos) para revalidar o catálogo de agregados mantido em memória
+CATALOG_REFRESH_INTERVAL = float(os.getenv("IBGE_CATALOG_REFRESH_INTERVAL", "3600"))
+
+# Paginação de consultar_dados_variaveis (séries por página)
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+
+# Máximo de agregados por chamada de obter_metadados_agregados
+MAX_METADADOS_POR_LOTE = 50
+
+# Enriquecimento do índice de busca em segundo plano
+PREFETCH_CONCURRENCY = int(os.getenv("IBGE_PREFETCH_CONCURRENCY", "4"))
+PREFETCH_RATE = float(os.getenv("IBGE_PREFETCH_RATE", "5"))
+PREFETCH_CHECKPOINT = int(os.getenv("IBGE_PREFETCH_CHECKPOINT", "50"))
+
+# Cache persistente de respostas (defina IBGE_CACHE_PATH="" para desativar)
+RESPONSE_CACHE_PATH = os.getenv(
+    "IBGE_CACHE_PATH", str(Path(__file__).with_name("ibge_response_cache.sqlite3"))
+)
+
+# Por quanto tempo (s) respostas expiradas ficam guardadas para uso com a API fora do ar
+CACHE_STALE_RETENTION = float(os.getenv("IBGE_CACHE_STALE_RETENTION", str(7 * 24 * 3600)))
+
+# Validade (em segundos) das respostas em cache, por classe de endpoint
+CACHE_TTLS: Dict[str, float] = {
+    "catalogo": 6 * 3600,
+    "metadados": 7 * 24 * 3600,
+    "localidades": 30 * 24 * 3600,
+    "periodos": 6 * 3600,
+    "variaveis": 7 * 24 * 3600,
+    # Consultas sem período explícito ou relativas ("-6") e os dados dos últimos
+    # períodos de cada agregado mudam a cada divulgação
+    "variaveis_recentes": 30 * 60,
+}
+
+# Quantos dos últimos períodos de cada agregado ficam na classe "variaveis_recentes"
+# (ainda sujeitos a revisão); os anteriores usam a validade longa de "variaveis"
+RECENT_PERIODS = int(os.getenv("IBGE_RECENT_PERIODS", "2"))
+
+# Stale-while-revalidate: por quanto tempo (s) após vencer uma resposta ainda é
+# servida de imediato enquanto é atualizada em segundo plano (0 desativa)
+STALE_WHILE_REVALIDATE = os.getenv("IBGE_STALE_WHILE_REVALIDATE", "1") != "0"
+CACHE_STALE_WHILE_REVALIDATE: Dict[str, float] = {
+    "catalogo": 24 * 3600,
+    "metadados": 7 * 24 * 3600,
+    "localidades": 7 * 24 * 3600,
+    "periodos": 6 * 3600,
+    "variaveis": 24 * 3600,
+    "variaveis_recentes": 0,
+}
+
+_RELATIVE_PERIOD_RE = re.compile(r"(^|[|,])-\d+")
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Ranqueamento BM25F da busca de agregados: peso de cada campo indexado
+SEARCH_FIELD_BOOSTS: Dict[str, float] = {
+    "agregado": 3.0,
+    "variavel": 2.0,
+    "pesquisa": 1.5,
+    "classificacao": 1.2,
+    "categoria": 1.0,
+    "contexto": 1.0,
+}
+# Códigos estáveis dos campos no arquivo binário do índice (não reordenar)
+INDEX_FIELD_CODES = ("agregado", "pesquisa", "variavel", "classificacao", "categoria", "contexto")
+
+# Formato binário do índice: cabeçalho + registros tipados anexados ao final
+INDEX_FORMAT_MAGIC = b"IBGEIDX\0"
+INDEX_FORMAT_VERSION = 1
+_INDEX_HEADER = struct.Struct("<8sH")
+_INDEX_RECORD = struct.Struct("<cI")
+_INDEX_ENTRY_HEAD = struct.Struct("<H")
+_INDEX_ENTRY_META = struct.Struct("<BdB")
+_INDEX_FIELD_HEAD = struct.Struct("<BI")
+
+# Variáveis listadas no resumo de metadados guardado no índice
+SUMMARY_MAX_VARIAVEIS = 20
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Peso de tokens que apenas contêm o termo buscado (ex: "popula" -> "populacao")
+PARTIAL_MATCH_WEIGHT = 0.5
+
+
+class JsonLogFormatter(logging.Formatter):
+    """Uma linha JSON por registro, incluindo os campos estruturados em ``extra={"campos": ...}``"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload: Dict[str, Any] = {
+            "ts": round(record.created, 3),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "mensagem": record.getMessage(),
+        }
+        payload.update(getattr(record, "campos", None) or {})
+        if record.exc_info:
+            payload["excecao"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT) -> None:
+    """Configura o logging do servidor em stderr (stdout é o canal MCP)"""
+    handler = logging.StreamHandler()
+    if fmt == "json":
+        handler.setFormatter(JsonLogFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(getattr(logging, level, logging.WARNING))
+    # Cada requisição já é registrada pelo cliente; o log do httpx só interessa em DEBUG
+    if root.level > logging.DEBUG:
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+class JsonCodec:
+    """Codificação e decodificação de JSON com backend plugável.
+
+    Usa orjson ou msgspec quando instalados (nessa ordem) e a biblioteca
+    padrão caso contrário; ``IBGE_JSON_BACKEND`` força um deles. A
+    decodificação aceita ``bytes`` diretamente, sem a cópia intermediária
+    em ``str``, e erros de qualquer backend viram ``ValueError``.
+    """
+
+    BACKENDS = ("orjson", "msgspec", "json")
+
+    def __init__(self, backend: Optional[str] = None):
+        backend = (backend or os.getenv("IBGE_JSON_BACKEND", "auto")).lower()
+        available = {"orjson": orjson is not None, "msgspec": msgspec is not None, "json": True}
+        if backend == "auto":
+            backend = next(name for name in self.BACKENDS if available[name])
+        elif not available.get(backend):
+            logger.warning("Backend JSON '%s' indisponível; usando a biblioteca padrão", backend)
+            backend = "json"
+        self.backend = backend
+        if backend == "msgspec":
+            self._encoder = msgspec.json.Encoder()
+            self._decoder = msgspec.json.Decoder()
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        if self.backend == "orjson":
+            return orjson.loads(data)
+        if self.backend == "msgspec":
+            try:
+                return self._decoder.decode(data)
+            except msgspec.DecodeError as exc:
+                raise ValueError(str(exc)) from exc
+        return json.loads(data)
+
+    def dumps(self, value: Any) -> bytes:
+        """JSON compacto em UTF-8"""
+        try:
+            if self.backend == "orjson":
+                return orjson.dumps(value)
+            if self.backend == "msgspec":
+                return self._encoder.encode(value)
+        except (TypeError, ValueError, OverflowError):
+            # Tipos ou inteiros que o backend rápido não aceita
+            pass
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def dumps_text(self, value: Any, indent: bool = False) -> str:
+        """JSON como texto (indentado para leitura humana se ``indent``)"""
+        if not indent:
+            return self.dumps(value).decode("utf-8")
+        if self.backend == "orjson":
+            try:
+                return orjson.dumps(value, option=orjson.OPT_INDENT_2).decode("utf-8")
+            except TypeError:
+                pass
+        return json.dumps(value, ensure_ascii=False, indent=2)
+
+
+json_codec = JsonCodec()
+
+
+def normalize_text(value: str) -> str:
+    """Remove acentos e normaliza caixa/espaços para comparação de nomes"""
+    if not value:
+        return ""
+    normalized = unicodedata.normalize("NFKD", value)
+    ascii_text = normalized.encode("ASCII", "ignore").decode("ASCII")
+    return ascii_text.lower().strip()
+
+
+def classify_endpoint(endpoint: str) -> str:
+    """Classifica um endpoint da API para fins de cache e métricas"""
+    if endpoint.rstrip("/") == "/agregados":
+        return "catalogo"
+    if endpoint.endswith("/metadados"):
+        return "metadados"
+    if "/localidades/" in endpoint:
+        return "localidades"
+    if "/variaveis/" in endpoint:
+        match = re.search(r"/periodos/([^/]+)/variaveis/", endpoint)
+        if not match or _RELATIVE_PERIOD_RE.search(match.group(1)):
+            return "variaveis_recentes"
+        return "variaveis"
+    if endpoint.endswith("/periodos"):
+        return "periodos"
+    return "outros"
+
+
+def retry_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Espera antes da próxima tentativa (backoff exponencial com jitter total).
+
+    Um ``Retry-After`` da API (em segundos ou data HTTP) é respeitado até
+    ``RETRY_AFTER_MAX``.
+    """
+    delay = random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * (2 ** attempt)))
+    if retry_after:
+        try:
+            wait = float(retry_after)
+        except ValueError:
+            parsed = parsedate_tz(retry_after)
+            wait = mktime_tz(parsed) - time.time() if parsed else 0.0
+        delay = max(delay, min(wait, RETRY_AFTER_MAX))
+    return delay
+
+
+def is_upstream_failure(exc: BaseException) -> bool:
+    """Indica se o erro sinaliza indisponibilidade da API (e não um pedido inválido)"""
+    if isinstance(exc, CircuitOpenError):
+        return True
+    if isinstance(exc, (requests.exceptions.HTTPError, httpx.HTTPStatusError)):
+        return exc.response is not None and exc.response.status_code in RETRYABLE_STATUS
+    return isinstance(
+        exc,
+        (requests.exceptions.ConnectionError, requests.exceptions.Timeout, httpx.TransportError),
+    )
+
+
+class CircuitOpenError(Exception):
+    """Requisição rejeitada localmente porque o disjuntor do endpoint está aberto"""
+
+    def __init__(self, endpoint_class: str, retry_in: float):
+        super().__init__(
+            f"API do IBGE indisponível para '{endpoint_class}' após falhas consecutivas; "
+            f"nova tentativa em {retry_in:.0f}s"
+        )
+        self.endpoint_class = endpoint_class
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Disjuntor de uma classe de endpoint.
+
+    Após ``failure_threshold`` falhas seguidas o circuito abre e as
+    requisições falham imediatamente por ``reset_timeout`` segundos; depois
+    disso uma única requisição de teste é liberada (meio-aberto), e o
+    resultado dela fecha ou reabre o circuito. ``failure_threshold`` <= 0
+    desativa o disjuntor.
+    """
+
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_started: Optional[float] = None
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self._opened_at < self.reset_timeout:
+                return False
+            # Meio-aberto: um teste por vez (um teste abandonado expira)
+            if self._probe_started is not None and now - self._probe_started < self.reset_timeout:
+                return False
+            self._probe_started = now
+            return True
+
+    def retry_in(self) -> float:
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe_started = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.failure_threshold <= 0:
+                return
+            if self._probe_started is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._probe_started = None
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            if self._opened_at is None:
+                estado = "fechado"
+            elif self._probe_started is not None:
+                estado = "meio-aberto"
+            else:
+                estado = "aberto"
+            return {"estado": estado, "falhas_consecutivas": self._failures}
+
+
+# Prioridade das requisições da tarefa atual no limitador de taxa: chamadas de
+# ferramentas (interativas) passam à frente do enriquecimento e revalidações
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+request_priority: contextvars.ContextVar[int] = contextvars.ContextVar(
+    "ibge_request_priority", default=PRIORITY_INTERACTIVE
+)
+# Dentro de uma requisição compartilhada (single-flight), a prioridade fica numa
+# lista mutável [prioridade]: quem se junta à requisição pode elevá-la
+flight_priority: contextvars.ContextVar[Optional[List[int]]] = contextvars.ContextVar(
+    "ibge_flight_priority", default=None
+)
+
+
+def current_priority() -> List[int]:
+    """Prioridade efetiva da tarefa atual, como lista mutável [prioridade]"""
+    holder = flight_priority.get()
+    return holder if holder is not None else [request_priority.get()]
+
+
+class TokenBucket:
+    """Balde de fichas: ``rate`` fichas por segundo, acumulando até ``burst``"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.capacity = max(1.0, burst)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self) -> float:
+        """Segundos até haver uma ficha disponível (0 se já houver)"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def take(self) -> None:
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1
+
+
+class RateLimiter:
+    """Limitador de taxa de requisições à API, global e por classe de endpoint.
+
+    Cada requisição consome uma ficha do balde global e, se configurado, do
+    balde da sua classe de endpoint. Quando faltam fichas, as requisições
+    aguardam numa fila atendida por prioridade (``current_priority``, que
+    pode ser elevada enquanto a requisição espera) e, na mesma prioridade,
+    por ordem de chegada.
+    """
+
+    def __init__(self, rate: float = RATE_LIMIT, burst: float = RATE_LIMIT_BURST,
+                 class_rates: Optional[Dict[str, float]] = None):
+        self._global = TokenBucket(rate, burst) if rate > 0 else None
+        self._classes = {
+            name: TokenBucket(class_rate, class_rate)
+            for name, class_rate in (RATE_LIMITS_BY_CLASS if class_rates is None else class_rates).items()
+            if class_rate > 0
+        }
+        # Fila: [[prioridade], ordem de chegada, classe, futuro]
+        self._queue: List[List[Any]] = []
+        self._sequence = 0
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._granted = [0, 0]
+        self._waited = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self._global is not None or bool(self._classes)
+
+    def _wait_time(self, endpoint_class: str) -> float:
+        waits = [bucket.wait_time() for bucket in (self._global, self._classes.get(endpoint_class)) if bucket]
+        return max(waits, default=0.0)
+
+    def _take(self, endpoint_class: str, priority: int) -> None:
+        for bucket in (self._global, self._classes.get(endpoint_class)):
+            if bucket:
+                bucket.take()
+        self._granted[min(priority, PRIORITY_BACKGROUND)] += 1
+
+    async def acquire(self, endpoint_class: str) -> None:
+        """Aguarda a vez de enviar uma requisição da classe informada"""
+        if not self.enabled:
+            return
+        priority = current_priority()
+        if not self._queue and self._wait_time(endpoint_class) == 0:
+            self._take(endpoint_class, priority[0])
+            return
+
+        started = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        self._sequence += 1
+        self._queue.append([priority, self._sequence, endpoint_class, future])
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+        else:
+            self._wakeup.set()
+        try:
+            await future
+        finally:
+            self._waited += time.monotonic() - started
+
+    async def _dispatch(self) -> None:
+        while self._queue:
+            # Reordena a cada volta: a prioridade de uma entrada pode ter sido elevada
+            self._queue = sorted(
+                (entry for entry in self._queue if not entry[3].done()),
+                key=lambda entry: (entry[0][0], entry[1]),
+            )
+            if not self._queue:
+                break
+            delay = float("inf")
+            global_wait = self._global.wait_time() if self._global else 0.0
+            if global_wait > 0:
+                delay = global_wait
+            else:
+                # A mais prioritária cuja classe tenha ficha; as demais continuam na fila
+                for entry in self._queue:
+                    wait = self._wait_time(entry[2])
+                    if wait == 0:
+                        self._take(entry[2], entry[0][0])
+                        entry[3].set_result(None)
+                        break
+                    delay = min(delay, wait)
+                else:
+                    entry = None
+                if entry is not None:
+                    self._queue.remove(entry)
+                    continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def acquire_sync(self, endpoint_class: str) -> None:
+        """Versão bloqueante para o cliente síncrono (sem fila de prioridade)"""
+        if not self.enabled:
+            return
+        started = time.monotonic()
+        while True:
+            wait = self._wait_time(endpoint_class)
+            if wait == 0:
+                self._take(endpoint_class, PRIORITY_INTERACTIVE)
+                break
+            time.sleep(wait)
+        self._waited += time.monotonic() - started
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "taxa_global": self._global.rate if self._global else None,
+            "taxas_por_classe": {name: bucket.rate for name, bucket in self._classes.items()},
+            "fila": sum(1 for entry in self._queue if not entry[3].done()),
+            "liberadas_interativas": self._granted[PRIORITY_INTERACTIVE],
+            "liberadas_segundo_plano": self._granted[PRIORITY_BACKGROUND],
+            "espera_total_s": round(self._waited, 3),
+        }
+
+
+class ResponseCache:
+    """Cache persistente (SQLite) de respostas da API, com TTL por classe de endpoint."""
+
+    def __init__(self, path: str, ttls: Optional[Dict[str, float]] = None):
+        self.path = path
+        self.ttls = dict(CACHE_TTLS if ttls is None else ttls)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                endpoint_class TEXT NOT NULL,
+                stored_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                body BLOB NOT NULL
+            )
+            """
+        )
+
+    @staticmethod
+    def make_key(endpoint: str, params: Optional[Dict[str, Any]] = None) -> str:
+        """Chave normalizada: endpoint sem barra final + parâmetros ordenados"""
+        key = endpoint.rstrip("/") or "/"
+        if params:
+            items = sorted((str(k), str(v)) for k, v in params.items() if v is not None)
+            if items:
+                key = f"{key}?{urlencode(items)}"
+        return key
+
+    def get(self, key: str, allow_stale: bool = False) -> Optional[Any]:
+        """Resposta em cache; com ``allow_stale`` também devolve entradas expiradas"""
+        entry = self.get_entry(key)
+        if entry is None or (entry[1] < time.time() and not allow_stale):
+            return None
+        return entry[0]
+
+    def get_entry(self, key: str) -> Optional[Tuple[Any, float, float]]:
+        """Resposta em cache, o instante em que vence (ou venceu) e o em que foi gravada"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT expires_at, stored_at, body FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return json_codec.loads(row[2]), row[0], row[1]
+
+    def set(self, key: str, endpoint_class: str, value: Any) -> None:
+        ttl = self.ttls.get(endpoint_class, 0)
+        if ttl <= 0:
+            return
+        now = time.time()
+        body = json_codec.dumps(value)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, endpoint_class, stored_at, expires_at, body)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, endpoint_class, now, now + ttl, body),
+            )
+
+    def purge_expired(self, grace: float = 0.0) -> int:
+        """Remove entradas expiradas há mais de ``grace`` segundos"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM responses WHERE expires_at < ?", (time.time() - grace,)
+            )
+        return cursor.rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_JSON_WS_RE = re.compile(r"[\s,:]*")
+_JSON_STRING_RE = re.compile(r'"(?:[^"\\]|\\.)*"', re.DOTALL)
+
+# Caminhos (no JSON de /variaveis) dos valores extraídos pelo parser incremental
+_SERIE_PATH = ("*", "resultados", "*", "series", "*")
+_CLASSIFICACOES_PATH = ("*", "resultados", "*", "classificacoes")
+_VARIAVEL_PATH = ("*",)
+_RESULTADO_PATH = ("*", "resultados", "*")
+
+
+class VariaveisStreamParser:
+    """Parser incremental da resposta de ``/variaveis`` (view padrão).
+
+    Recebe o corpo em pedaços e devolve uma linha por item de ``series``
+    assim que ele chega completo, sem manter a resposta inteira em memória::
+
+        {"variavel": {"id", "variavel", "unidade"}, "classificacoes": [...], "serie": {...}}
+
+    Os atributos da variável precisam preceder ``resultados`` e
+    ``classificacoes`` preceder ``series`` dentro de cada resultado, que é a
+    ordem em que a API do IBGE os envia.
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        # Cada nível aberto: [tipo ("a" ou "o"), chave atual, esperando chave?]
+        self._stack: List[List[Any]] = []
+        self._variavel: Dict[str, Any] = {}
+        self._classificacoes: List[Dict[str, Any]] = []
+
+    def feed(self, chunk: bytes) -> List[Dict[str, Any]]:
+        self._buffer += self._utf8.decode(chunk)
+        return self._parse(final=False)
+
+    def close(self) -> List[Dict[str, Any]]:
+        self._buffer += self._utf8.decode(b"", final=True)
+        rows = self._parse(final=True)
+        if self._stack or self._buffer.strip():
+            raise ValueError("Resposta JSON de variáveis incompleta")
+        return rows
+
+    def _path(self) -> Tuple[str, ...]:
+        return tuple("*" if frame[0] == "a" else frame[1] for frame in self._stack)
+
+    def _parse(self, final: bool) -> List[Dict[str, Any]]:
+        rows: List[Dict[str, Any]] = []
+        buf = self._buffer
+        pos = 0
+        while True:
+            pos = _JSON_WS_RE.match(buf, pos).end()
+            if pos >= len(buf):
+                break
+            char = buf[pos]
+            frame = self._stack[-1] if self._stack else None
+
+            if char in "]}":
+                self._stack.pop()
+                pos += 1
+                if self._stack and self._stack[-1][0] == "o":
+                    self._stack[-1][2] = True
+                continue
+
+            if frame is not None and frame[0] == "o" and frame[2]:
+                match = _JSON_STRING_RE.match(buf, pos)
+                if match is None:
+                    break  # chave ainda incompleta
+                frame[1] = json.loads(match.group(0))
+                frame[2] = False
+                pos = match.end()
+                continue
+
+            path = self._path()
+            capture = (
+                path == _SERIE_PATH
+                or path == _CLASSIFICACOES_PATH
+                or (len(path) == 2 and path[1] != "resultados")
+            )
+            if char in "[{" and not capture:
+                if path == _VARIAVEL_PATH:
+                    self._variavel = {}
+                elif path == _RESULTADO_PATH:
+                    self._classificacoes = []
+                self._stack.append(["a" if char == "[" else "o", None, char == "{"])
+                pos += 1
+                continue
+
+            try:
+                value, end = self._decoder.raw_decode(buf, pos)
+            except ValueError:
+                if final:
+                    raise
+                break  # valor ainda incompleto
+            if end == len(buf) and not final and char not in '"[{':
+                break  # número ou literal pode continuar no próximo pedaço
+            pos = end
+            if frame is not None and frame[0] == "o":
+                frame[2] = True
+
+            if path == _SERIE_PATH:
+                rows.append({
+                    "variavel": dict(self._variavel),
+                    "classificacoes": self._classificacoes,
+                    "serie": value,
+                })
+            elif path == _CLASSIFICACOES_PATH:
+                self._classificacoes = value
+            elif len(path) == 2:
+                self._variavel[path[1]] = value
+
+        self._buffer = buf[pos:]
+        return rows
+
+
+def iter_variaveis_rows(dados: List[Dict[str, Any]]):
+    """Gera as mesmas linhas do VariaveisStreamParser a partir de uma resposta já decodificada"""
+    for variavel in dados:
+        atributos = {k: v for k, v in variavel.items() if k != "resultados"}
+        for resultado in variavel.get("resultados", []):
+            classificacoes = resultado.get("classificacoes", [])
+            for serie in resultado.get("series", []):
+                yield {"variavel": atributos, "classificacoes": classificacoes, "serie": serie}
+
+
+def merge_variaveis(partes: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Mescla respostas parciais de ``/variaveis`` (divididas por período ou localidade)"""
+    variaveis: Dict[str, Dict[str, Any]] = {}
+    resultados: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    series: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+    for parte in partes:
+        for variavel in parte or []:
+            var_key = str(variavel.get("id"))
+            destino = variaveis.get(var_key)
+            if destino is None:
+                destino = variaveis[var_key] = {
+                    **{k: v for k, v in variavel.items() if k != "resultados"},
+                    "resultados": [],
+                }
+            for resultado in variavel.get("resultados", []):
+                classificacoes = resultado.get("classificacoes", [])
+                res_key = (var_key, json.dumps(classificacoes, sort_keys=True))
+                res_destino = resultados.get(res_key)
+                if res_destino is None:
+                    res_destino = resultados[res_key] = {"classificacoes": classificacoes, "series": []}
+                    destino["resultados"].append(res_destino)
+                for serie in resultado.get("series", []):
+                    loc_key = str(serie.get("localidade", {}).get("id"))
+                    serie_destino = series.get((*res_key, loc_key))
+                    if serie_destino is None:
+                        serie_destino = series[(*res_key, loc_key)] = {**serie, "serie": {}}
+                        res_destino["series"].append(serie_destino)
+                    serie_destino["serie"].update(serie.get("serie", {}))
+    for serie_destino in series.values():
+        serie_destino["serie"] = dict(sorted(serie_destino["serie"].items()))
+    return list(variaveis.values())
+
+
+def rows_to_variaveis(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Reagrupa linhas no formato aninhado original de ``/variaveis``"""
+    variaveis: Dict[str, Dict[str, Any]] = {}
+    resultados: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for row in rows:
+        atributos = row["variavel"]
+        var_key = str(atributos.get("id"))
+        variavel = variaveis.get(var_key)
+        if variavel is None:
+            variavel = variaveis[var_key] = {**atributos, "resultados": []}
+        res_key = (var_key, json.dumps(row["classificacoes"], sort_keys=True))
+        resultado = resultados.get(res_key)
+        if resultado is None:
+            resultado = resultados[res_key] = {"classificacoes": row["classificacoes"], "series": []}
+            variavel["resultados"].append(resultado)
+        resultado["series"].append(row["serie"])
+    return list(variaveis.values())
+
+
+def split_variaveis_por_periodo(dados: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """Separa uma resposta de ``/variaveis`` em uma resposta por período (inverso de merge_variaveis)"""
+    linhas: Dict[str, List[Dict[str, Any]]] = {}
+    for row in iter_variaveis_rows(dados):
+        for periodo, valor in row["serie"].get("serie", {}).items():
+            serie = {**row["serie"], "serie": {periodo: valor}}
+            linhas.setdefault(str(periodo), []).append({**row, "serie": serie})
+    return {periodo: rows_to_variaveis(rows) for periodo, rows in linhas.items()}
+
+
+_PERIODO_ID_RE = re.compile(r"\d{4,8}")
+_PERIODO_INTERVALO_RE = re.compile(r"(\d{4,8})-(\d{4,8})")
+
+
+def parse_period_expression(expressao: str) -> List[Tuple[Any, ...]]:
+    """Valida uma expressão de períodos da API e a decompõe em termos.
+
+    Itens separados por "|" ou ",": "-N" (últimos N), "inicio-fim" (intervalo
+    inclusivo, ex: "201701-201706"), um ID ("2020", "202001") ou "all". Cada
+    termo é ("ultimos", N), ("intervalo", inicio, fim), ("periodo", id) ou
+    ("todos",). Expressões inválidas levantam ValueError antes de qualquer
+    requisição.
+    """
+    termos: List[Tuple[Any, ...]] = []
+    for parte in re.split(r"[|,]", expressao or ""):
+        parte = parte.strip()
+        if not parte:
+            continue
+        if parte.lower() == "all":
+            termos.append(("todos",))
+        elif re.fullmatch(r"-\d+", parte):
+            quantidade = int(parte[1:])
+            if quantidade < 1:
+                raise ValueError(f"Período relativo inválido: '{parte}' (use -1 ou mais)")
+            termos.append(("ultimos", quantidade))
+        elif _PERIODO_INTERVALO_RE.fullmatch(parte):
+            inicio, fim = _PERIODO_INTERVALO_RE.fullmatch(parte).groups()
+            tamanho = min(len(inicio), len(fim))
+            if inicio[:tamanho] > fim[:tamanho]:
+                raise ValueError(f"Intervalo de períodos invertido: '{parte}'")
+            termos.append(("intervalo", inicio, fim))
+        elif _PERIODO_ID_RE.fullmatch(parte):
+            termos.append(("periodo", parte))
+        else:
+            raise ValueError(
+                f"Período inválido: '{parte}' (use IDs como 2020 ou 202001, intervalos "
+                f"como 201701-201706, '-6' para os últimos 6 ou 'all')"
+            )
+    if not termos:
+        raise ValueError("Expressão de períodos vazia")
+    return termos
+
+
+def period_in_range(periodo: str, inicio: str, fim: str) -> bool:
+    """Indica se o ID do período está no intervalo, comparando na menor granularidade
+    em comum (assim "2017-2018" abrange "201701" e "201701-201812" abrange "2017")"""
+    return (periodo[:len(inicio)] >= inicio[:len(periodo)]
+            and periodo[:len(fim)] <= fim[:len(periodo)])
+
+
+class VariaveisTable:
+    """Representação colunar dos resultados de ``/variaveis``.
+
+    Cada célula (variável × classificações × localidade × período) ocupa uma
+    posição em arrays tipados: ``valores`` (float64, NaN quando não numérico),
+    ``marcadores`` (código do valor especial, 0 para valores numéricos) e
+    códigos inteiros para as dimensões categóricas, cujos rótulos ficam em
+    ``variaveis``, ``localidades``, ``periodos`` e ``categorias``.
+    O valor especial "-" (zero absoluto) é guardado como 0.0 com marcador 1.
+    """
+
+    MARCADORES = ("", "-", "..", "...", "X", "?")
+    DIMENSOES = ("variavel", "categoria", "localidade", "periodo")
+    OPERACOES = ("soma", "media", "minimo", "maximo", "contagem", "crescimento")
+    _MARCADOR_CODIGOS = {"-": 1, "..": 2, "...": 3, "X": 4}
+
+    def __init__(self):
+        self.valores = array("d")
+        self.marcadores = array("b")
+        self.variavel = array("i")
+        self.categoria = array("i")
+        self.localidade = array("i")
+        self.periodo = array("i")
+        self.variaveis: List[Dict[str, Any]] = []
+        self.categorias: List[List[Dict[str, Any]]] = []
+        self.localidades: List[Dict[str, Any]] = []
+        self.periodos: List[str] = []
+        self._codigos: Dict[str, Dict[Any, int]] = {
+            "variavel": {}, "categoria": {}, "localidade": {}, "periodo": {},
+        }
+
+    def __len__(self) -> int:
+        return len(self.valores)
+
+    def _codigo(self, dimensao: str, chave: Any, rotulos: List[Any], rotulo: Any) -> int:
+        codigos = self._codigos[dimensao]
+        codigo = codigos.get(chave)
+        if codigo is None:
+            codigo = codigos[chave] = len(rotulos)
+            rotulos.append(rotulo)
+        return codigo
+
+    def append_row(self, row: Dict[str, Any]) -> None:
+        """Acrescenta as células de uma linha (formato de iter_variaveis_rows)"""
+        atributos = row["variavel"]
+        var_code = self._codigo("variavel", str(atributos.get("id")), self.variaveis, {
+            "id": atributos.get("id"),
+            "nome": atributos.get("variavel"),
+            "unidade": atributos.get("unidade"),
+        })
+        combinacao = []
+        for classificacao in row.get("classificacoes") or []:
+            for categoria_id, categoria_nome in (classificacao.get("categoria") or {}).items():
+                combinacao.append({
+                    "classificacao_id": classificacao.get("id"),
+                    "classificacao": classificacao.get("nome"),
+                    "categoria_id": categoria_id,
+                    "categoria": categoria_nome,
+                })
+        cat_code = self._codigo(
+            "categoria",
+            tuple((c["classificacao_id"], c["categoria_id"]) for c in combinacao),
+            self.categorias,
+            combinacao,
+        )
+        serie = row["serie"]
+        localidade = serie.get("localidade") or {}
+        loc_code = self._codigo("localidade", str(localidade.get("id")), self.localidades, localidade)
+
+        for periodo, bruto in (serie.get("serie") or {}).items():
+            self.variavel.append(var_code)
+            self.categoria.append(cat_code)
+            self.localidade.append(loc_code)
+            self.periodo.append(self._codigo("periodo", periodo, self.periodos, periodo))
+            marcador = self._MARCADOR_CODIGOS.get(bruto)
+            if marcador == 1:
+                self.valores.append(0.0)
+            elif marcador is not None or bruto is None:
+                self.valores.append(math.nan)
+                marcador = marcador or 3
+            else:
+                try:
+                    self.valores.append(float(bruto))
+                    marcador = 0
+                except (TypeError, ValueError):
+                    self.valores.append(math.nan)
+                    marcador = 5
+            self.marcadores.append(marcador)
+
+    @classmethod
+    def from_rows(cls, rows) -> "VariaveisTable":
+        table = cls()
+        for row in rows:
+            table.append_row(row)
+        return table
+
+    @classmethod
+    def from_variaveis(cls, dados: List[Dict[str, Any]]) -> "VariaveisTable":
+        return cls.from_rows(iter_variaveis_rows(dados))
+
+    def memory_bytes(self) -> int:
+        """Bytes ocupados pelas colunas tipadas (sem os dicionários de rótulos)"""
+        return sum(
+            column.itemsize * len(column)
+            for column in (self.valores, self.marcadores, self.variavel,
+                           self.categoria, self.localidade, self.periodo)
+        )
+
+    def to_numpy(self) -> Dict[str, Any]:
+        """Colunas como arrays NumPy sem cópia (requer NumPy instalado)"""
+        if np is None:
+            raise Exception("NumPy não está instalado; use as colunas array.array diretamente")
+        return {
+            "valores": np.frombuffer(self.valores, dtype=np.float64),
+            "marcadores": np.frombuffer(self.marcadores, dtype=np.int8),
+            "variavel": np.frombuffer(self.variavel, dtype=np.intc),
+            "categoria": np.frombuffer(self.categoria, dtype=np.intc),
+            "localidade": np.frombuffer(self.localidade, dtype=np.intc),
+            "periodo": np.frombuffer(self.periodo, dtype=np.intc),
+        }
+
+    def _rotulo(self, dimensao: str, codigo: int) -> Any:
+        if dimensao == "variavel":
+            return self.variaveis[codigo]
+        if dimensao == "categoria":
+            return ", ".join(
+                f"{c['classificacao']}: {c['categoria']}" for c in self.categorias[codigo]
+            ) or "Total"
+        if dimensao == "localidade":
+            localidade = self.localidades[codigo]
+            return {"id": localidade.get("id"), "nome": localidade.get("nome")}
+        return self.periodos[codigo]
+
+    @classmethod
+    def validate_aggregation(cls, agrupar_por: List[str], operacao: str) -> None:
+        for dimensao in agrupar_por:
+            if dimensao not in cls.DIMENSOES:
+                raise Exception(
+                    f"Dimensão inválida: {dimensao}. Use: {', '.join(cls.DIMENSOES)}"
+                )
+        if operacao not in cls.OPERACOES:
+            raise Exception(f"Operação inválida: {operacao}. Use: {', '.join(cls.OPERACOES)}")
+        if operacao == "crescimento" and "periodo" in agrupar_por:
+            raise Exception("A operação 'crescimento' não pode agrupar por período")
+
+    def aggregate(self, agrupar_por: List[str], operacao: str) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+        """Agrega as células numéricas por dimensões.
+
+        Valores especiais diferentes de "-" (que vale zero) ficam fora do
+        cálculo e são contabilizados no segundo item do retorno. A operação
+        "crescimento" compara o total do primeiro e do último período com
+        valores de cada grupo (agrupar_por não pode conter "periodo").
+        """
+        self.validate_aggregation(agrupar_por, operacao)
+        colunas = [getattr(self, dimensao) for dimensao in agrupar_por]
+        ignoradas: Dict[str, int] = {}
+        grupos: Dict[Tuple[int, ...], List[float]] = {}
+        por_periodo: Dict[Tuple[int, ...], Dict[int, float]] = {}
+        for i, valor in enumerate(self.valores):
+            marcador = self.marcadores[i]
+            if marcador > 1:
+                simbolo = self.MARCADORES[marcador]
+                ignoradas[simbolo] = ignoradas.get(simbolo, 0) + 1
+                continue
+            chave = tuple(coluna[i] for coluna in colunas)
+            if operacao == "crescimento":
+                totais = por_periodo.setdefault(chave, {})
+                totais[self.periodo[i]] = totais.get(self.periodo[i], 0.0) + valor
+                continue
+            acumulado = grupos.get(chave)
+            if acumulado is None:
+                grupos[chave] = [valor, 1.0, valor, valor]  # soma, contagem, mínimo, máximo
+            else:
+                acumulado[0] += valor
+                acumulado[1] += 1
+                if valor < acumulado[2]:
+                    acumulado[2] = valor
+                if valor > acumulado[3]:
+                    acumulado[3] = valor
+
+        resultados: List[Dict[str, Any]] = []
+        if operacao == "crescimento":
+            for chave, totais in por_periodo.items():
+                ordenados = sorted(totais.items(), key=lambda item: self.periodos[item[0]])
+                (p_ini, v_ini), (p_fim, v_fim) = ordenados[0], ordenados[-1]
+                resultado = {d: self._rotulo(d, c) for d, c in zip(agrupar_por, chave)}
+                resultado.update({
+                    "periodo_inicial": self.periodos[p_ini],
+                    "periodo_final": self.periodos[p_fim],
+                    "valor_inicial": v_ini,
+                    "valor_final": v_fim,
+                    "valor": (v_fim / v_ini - 1) * 100 if v_ini and len(ordenados) > 1 else None,
+                })
+                resultados.append(resultado)
+        else:
+            for chave, (soma, contagem, minimo, maximo) in grupos.items():
+                valor = {
+                    "soma": soma,
+                    "media": soma / contagem,
+                    "minimo": minimo,
+                    "maximo": maximo,
+                    "contagem": contagem,
+                }[operacao]
+                resultado = {d: self._rotulo(d, c) for d, c in zip(agrupar_por, chave)}
+                resultado.update({"valor": valor, "celulas": int(contagem)})
+                resultados.append(resultado)
+        return resultados, ignoradas
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Forma colunar serializável: colunas de códigos + dicionários de rótulos"""
+        return {
+            "total_celulas": len(self),
+            "colunas": {
+                "valor": [None if math.isnan(v) else v for v in self.valores],
+                "marcador": list(self.marcadores),
+                "variavel": list(self.variavel),
+                "categoria": list(self.categoria),
+                "localidade": list(self.localidade),
+                "periodo": list(self.periodo),
+            },
+            "dicionarios": {
+                "marcador": list(self.MARCADORES),
+                "variavel": self.variaveis,
+                "categoria": self.categorias,
+                "localidade": self.localidades,
+                "periodo": self.periodos,
+            },
+        }
+
+
+class MetricsRegistry:
+    """Métricas de execução do cliente HTTP, agrupadas por classe de endpoint.
+
+    Registra contagem de requisições por status, histograma de latência,
+    bytes recebidos e acertos do cache persistente. É seguro para uso entre
+    threads (o endpoint HTTP opcional de métricas roda em uma thread própria).
+    """
+
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests: Dict[Tuple[str, str], int] = {}
+        self._latency: Dict[str, List[float]] = {}
+        self._latency_sum: Dict[str, float] = {}
+        self._bytes: Dict[str, int] = {}
+        self._cache: Dict[Tuple[str, str], int] = {}
+        self._retries: Dict[str, int] = {}
+        self.started_at = time.time()
+
+    def observe_request(self, endpoint_class: str, status: Any, seconds: float, size: int = 0) -> None:
+        with self._lock:
+            key = (endpoint_class, str(status))
+            self._requests[key] = self._requests.get(key, 0) + 1
+            buckets = self._latency.setdefault(endpoint_class, [0] * (len(self.LATENCY_BUCKETS) + 1))
+            buckets[bisect.bisect_left(self.LATENCY_BUCKETS, seconds)] += 1
+            self._latency_sum[endpoint_class] = self._latency_sum.get(endpoint_class, 0.0) + seconds
+            self._bytes[endpoint_class] = self._bytes.get(endpoint_class, 0) + size
+
+    def observe_retry(self, endpoint_class: str) -> None:
+        with self._lock:
+            self._retries[endpoint_class] = self._retries.get(endpoint_class, 0) + 1
+
+    def observe_cache(self, endpoint_class: str, result: str) -> None:
+        """``result``: "hit", "miss" ou "stale" (vencida, servida durante a revalidação)"""
+        with self._lock:
+            key = (endpoint_class, result)
+            self._cache[key] = self._cache.get(key, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            endpoints: Dict[str, Dict[str, Any]] = {}
+            for (endpoint_class, status), count in self._requests.items():
+                info = endpoints.setdefault(endpoint_class, {"requisicoes": 0, "por_status": {}})
+                info["requisicoes"] += count
+                info["por_status"][status] = count
+            for endpoint_class, buckets in self._latency.items():
+                info = endpoints[endpoint_class]
+                total = sum(buckets)
+                info["latencia_media_s"] = round(self._latency_sum[endpoint_class] / total, 4)
+                info["latencia_p50_s"] = self._quantile(buckets, 0.5)
+                info["latencia_p95_s"] = self._quantile(buckets, 0.95)
+                info["latencia_p99_s"] = self._quantile(buckets, 0.99)
+                info["bytes_recebidos"] = self._bytes.get(endpoint_class, 0)
+            for (endpoint_class, result), count in self._cache.items():
+                info = endpoints.setdefault(endpoint_class, {"requisicoes": 0, "por_status": {}})
+                info[f"cache_{result}"] = count
+            for endpoint_class, count in self._retries.items():
+                endpoints.setdefault(endpoint_class, {"requisicoes": 0, "por_status": {}})["novas_tentativas"] = count
+            for info in endpoints.values():
+                hits = info.get("cache_hit", 0) + info.get("cache_stale", 0)
+                misses = info.get("cache_miss", 0)
+                if hits + misses:
+                    info["cache_taxa_acerto"] = round(hits / (hits + misses), 4)
+            return {"desde": self.started_at, "endpoints": endpoints}
+
+    def _quantile(self, buckets: List[int], q: float) -> Optional[float]:
+        """Limite superior do bucket que contém o quantil (estimativa estilo Prometheus)"""
+        total = sum(buckets)
+        if not total:
+            return None
+        acumulado = 0
+        for limite, count in zip(self.LATENCY_BUCKETS + (float("inf"),), buckets):
+            acumulado += count
+            if acumulado >= q * total:
+                return limite if limite != float("inf") else None
+        return None
+
+    def render_prometheus(self, gauges: Optional[Dict[str, float]] = None,
+                          counters: Optional[Dict[str, float]] = None) -> str:
+        """Exposição no formato texto do Prometheus, com contadores e medidores externos"""
+        linhas: List[str] = []
+        with self._lock:
+            linhas.append("# TYPE ibge_requests_total counter")
+            for (endpoint_class, status), count in sorted(self._requests.items()):
+                linhas.append(f'ibge_requests_total{{endpoint="{endpoint_class}",status="{status}"}} {count}')
+            linhas.append("# TYPE ibge_request_duration_seconds histogram")
+            for endpoint_class, buckets in sorted(self._latency.items()):
+                acumulado = 0
+                for limite, count in zip(self.LATENCY_BUCKETS + (float("inf"),), buckets):
+                    acumulado += count
+                    le = "+Inf" if limite == float("inf") else repr(limite)
+                    linhas.append(
+                        f'ibge_request_duration_seconds_bucket{{endpoint="{endpoint_class}",le="{le}"}} {acumulado}'
+                    )
+                linhas.append(
+                    f'ibge_request_duration_seconds_sum{{endpoint="{endpoint_class}"}} {self._latency_sum[endpoint_class]:.6f}'
+                )
+                linhas.append(f'ibge_request_duration_seconds_count{{endpoint="{endpoint_class}"}} {acumulado}')
+            linhas.append("# TYPE ibge_response_bytes_total counter")
+            for endpoint_class, size in sorted(self._bytes.items()):
+                linhas.append(f'ibge_response_bytes_total{{endpoint="{endpoint_class}"}} {size}')
+            linhas.append("# TYPE ibge_request_retries_total counter")
+            for endpoint_class, count in sorted(self._retries.items()):
+                linhas.append(f'ibge_request_retries_total{{endpoint="{endpoint_class}"}} {count}')
+            linhas.append("# TYPE ibge_response_cache_total counter")
+            for (endpoint_class, result), count in sorted(self._cache.items()):
+                linhas.append(f'ibge_response_cache_total{{endpoint="{endpoint_class}",result="{result}"}} {count}')
+        for tipo, valores in (("counter", counters), ("gauge", gauges)):
+            for name, value in sorted((valores or {}).items()):
+                linhas.append(f"# TYPE {name} {tipo}")
+                linhas.append(f"{name} {value}")
+        return "\n".join(linhas) + "\n"
+
+
+class LRUByteCache:
+    """Cache em memória com despejo LRU limitado pelo tamanho estimado em bytes."""
+
+    def __init__(self, capacity_bytes: int):
+        self.capacity_bytes = capacity_bytes
+        self._entries: "OrderedDict[str, Tuple[Any, int]]" = OrderedDict()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejected = 0
+
+    @staticmethod
+    def estimate_size(value: Any) -> int:
+        # Tamanho do JSON compacto: proporcional ao custo real e barato de calcular
+        return len(json_codec.dumps(value))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key: str, value: Any) -> None:
+        size = self.estimate_size(value)
+        if key in self._entries:
+            self.size_bytes -= self._entries.pop(key)[1]
+        if size > self.capacity_bytes:
+            self.rejected += 1
+            return
+        while self._entries and self.size_bytes + size > self.capacity_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.size_bytes -= evicted_size
+            self.evictions += 1
+        self._entries[key] = (value, size)
+        self.size_bytes += size
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entradas": len(self._entries),
+            "bytes": self.size_bytes,
+            "capacidade_bytes": self.capacity_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "despejos": self.evictions,
+            "rejeitados": self.rejected,
+            "taxa_acerto": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+class PeriodResolver:
+    """Resolve expressões de períodos localmente em IDs concretos.
+
+    A lista de períodos de cada agregado fica em memória, começando pela
+    gravada no cache persistente (com a idade da gravação), e é renovada na API
+    quando passa de ``max_age`` segundos — a mesma validade das consultas
+    relativas —, de modo que "-6" resolvido aqui não fica mais defasado do que
+    uma consulta relativa em cache ficaria. Expressões só com IDs dispensam a
+    lista: usam a disponível e a renovam em segundo plano (``revalidate``).
+    """
+
+    def __init__(self, client: "IBGEAPIClient", max_age: float = CACHE_TTLS["variaveis_recentes"]):
+        self.client = client
+        self.max_age = max_age
+        self._listas: Dict[int, Tuple[float, List[Dict[str, Any]], List[str]]] = {}
+        self._revalidando: Set[int] = set()
+
+    def _disponivel(self, agregado_id: int) -> Optional[Tuple[float, List[Dict[str, Any]], List[str]]]:
+        """Lista em memória ou, na falta dela, a do cache persistente (mesmo vencida)"""
+        item = self._listas.get(agregado_id)
+        if item is None:
+            cached = self.client.cached_periodos(agregado_id)
+            if cached is not None:
+                idade, periodos = cached
+                item = (time.monotonic() - idade, periodos, [str(p.get("id")) for p in periodos])
+                self._listas[agregado_id] = item
+        return item
+
+    def _vencida(self, item: Optional[Tuple[float, List[Dict[str, Any]], List[str]]]) -> bool:
+        return item is None or time.monotonic() - item[0] >= self.max_age
+
+    async def _atualizar(self, agregado_id: int) -> Tuple[float, List[Dict[str, Any]], List[str]]:
+        periodos = await self.client.refresh_periodos_async(agregado_id)
+        item = (time.monotonic(), periodos, [str(p.get("id")) for p in periodos])
+        self._listas[agregado_id] = item
+        return item
+
+    async def _lista(self, agregado_id: int) -> Tuple[float, List[Dict[str, Any]], List[str]]:
+        item = self._disponivel(agregado_id)
+        if self._vencida(item):
+            item = await self._atualizar(agregado_id)
+        return item
+
+    def revalidate(self, agregado_id: int) -> None:
+        """Renova em segundo plano a lista ausente ou vencida, sem esperar por ela"""
+        if agregado_id in self._revalidando or not self._vencida(self._disponivel(agregado_id)):
+            return
+        self._revalidando.add(agregado_id)
+
+        async def refresh() -> None:
+            request_priority.set(PRIORITY_BACKGROUND)
+            try:
+                await self._atualizar(agregado_id)
+            except Exception as exc:
+                logger.warning("Falha ao renovar os períodos do agregado %s: %s", agregado_id, exc)
+            finally:
+                self._revalidando.discard(agregado_id)
+
+        self.client._run_in_background(refresh())
+
+    async def periodos(self, agregado_id: int) -> List[Dict[str, Any]]:
+        """Lista completa de períodos do agregado (objetos da API)"""
+        return (await self._lista(agregado_id))[1]
+
+    async def ids(self, agregado_id: int) -> List[str]:
+        """IDs dos períodos do agregado, em ordem cronológica"""
+        return (await self._lista(agregado_id))[2]
+
+    def is_recent(self, agregado_id: int, periodos: str) -> bool:
+        """Indica se a expressão alcança algum dos RECENT_PERIODS últimos períodos.
+
+        Usa a lista disponível (mesmo vencida). Sem ela, ou para períodos
+        que ainda não constam da lista, a resposta é conservadora: sim.
+        """
+        item = self._disponivel(agregado_id)
+        if item is None:
+            return True
+        disponiveis = item[2]
+        recentes = disponiveis[-RECENT_PERIODS:] if RECENT_PERIODS > 0 else []
+        try:
+            termos = parse_period_expression(periodos)
+        except ValueError:
+            return True
+        for termo in termos:
+            if termo[0] in ("todos", "ultimos"):
+                if recentes:
+                    return True
+            elif termo[0] == "intervalo":
+                if any(period_in_range(p, termo[1], termo[2]) for p in recentes):
+                    return True
+            elif termo[1] in recentes or termo[1] not in disponiveis:
+                return True
+        return False
+
+    def invalidate(self, agregado_id: Optional[int] = None) -> None:
+        if agregado_id is None:
+            self._listas.clear()
+        else:
+            self._listas.pop(agregado_id, None)
+
+    async def resolve(self, agregado_id: int, periodos: Optional[str]) -> List[str]:
+        """Converte a expressão ("-6", "201701-201706", "2019|2020", "all") em IDs.
+
+        Sem expressão, resolve para o último período (o mesmo que a API devolve).
+        IDs explícitos são mantidos mesmo que não constem da lista.
+        """
+        termos = parse_period_expression(periodos) if periodos else [("ultimos", 1)]
+        if all(termo[0] == "periodo" for termo in termos):
+            return list(dict.fromkeys(termo[1] for termo in termos))
+
+        disponiveis = await self.ids(agregado_id)
+        resolvidos: List[str] = []
+        for termo in termos:
+            if termo[0] == "todos":
+                resolvidos.extend(disponiveis)
+            elif termo[0] == "ultimos":
+                resolvidos.extend(disponiveis[-termo[1]:])
+            elif termo[0] == "intervalo":
+                resolvidos.extend(p for p in disponiveis if period_in_range(p, termo[1], termo[2]))
+            else:
+                resolvidos.append(termo[1])
+        if not resolvidos:
+            faixa = f"{disponiveis[0]} a {disponiveis[-1]}" if disponiveis else "nenhum"
+            raise ValueError(
+                f"Nenhum período do agregado {agregado_id} corresponde a '{periodos}' "
+                f"(disponíveis: {faixa})"
+            )
+        return list(dict.fromkeys(resolvidos))
+
 
 class IBGEAPIClient:
     """Cliente para interagir com a API do IBGE"""
     
-    def __init__(self):
+    def __init__(
+        self,
+        max_connections: int = MAX_CONNECTIONS,
+        max_keepalive_connections: int = MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = KEEPALIVE_EXPIRY,
+        max_concurrency_per_host: int = MAX_CONCURRENCY_PER_HOST,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        cache_path: Optional[str] = RESPONSE_CACHE_PATH,
+        metadata_cache_bytes: int = METADATA_CACHE_BYTES,
+        metrics: Optional[MetricsRegistry] = None,
+        retry_attempts: int = RETRY_MAX_ATTEMPTS,
+        rate_limiter: Optional[RateLimiter] = None,
+    ):
         self.base_url = BASE_URL
         self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'MCP-IBGE-Server/1.0',
-            'Accept': 'application/json'
-        })
-        self._metadata_cache: Dict[str, Dict[str, Any]] = {}
-        self._cache_stats = {"hits": 0, "misses": 0}
+        self.session.headers.update(DEFAULT_HEADERS)
+        self._metadata_cache = LRUByteCache(metadata_cache_bytes)
+        self.metrics = metrics or MetricsRegistry()
+        self.retry_attempts = max(1, retry_attempts)
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._request_ids = itertools.count(1)
+
+        # Modo assíncrono: um único AsyncClient com pool limitado e keep-alive,
+        # criado sob demanda dentro do event loop que o utiliza.
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._transport = transport
+        self._max_concurrency_per_host = max(1, max_concurrency_per_host)
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+        # Single-flight: requisições idênticas concorrentes compartilham a mesma tarefa
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._flight_priorities: Dict[str, List[int]] = {}
+        self._coalesced_requests = 0
+        # Revalidações em segundo plano de entradas vencidas (stale-while-revalidate)
+        self._revalidating: Set[str] = set()
+        self._background_tasks: Set[asyncio.Task] = set()
+        # Listas de períodos por agregado, para resolver expressões localmente
+        self.period_resolver = PeriodResolver(self)
+
+        self._response_cache: Optional[ResponseCache] = None
+        if cache_path:
+            try:
+                self._response_cache = ResponseCache(cache_path)
+                self._response_cache.purge_expired(CACHE_STALE_RETENTION)
+            except sqlite3.Error as exc:
+                logger.warning("Cache persistente indisponível (%s): %s", cache_path, exc)
     
+    def _get_async_client(self) -> httpx.AsyncClient:
+        if self._async_client is None or self._async_client.is_closed:
+            self._async_client = httpx.AsyncClient(
+                headers=DEFAULT_HEADERS,
+                timeout=REQUEST_TIMEOUT,
+                limits=self._limits,
+                transport=self._transport,
+            )
+        return self._async_client
+
+    def _host_semaphore(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self._max_concurrency_per_host)
+            self._host_semaphores[host] = semaphore
+        return semaphore
+
+    def _breaker(self, endpoint_class: str) -> CircuitBreaker:
+        breaker = self._breakers.get(endpoint_class)
+        if breaker is None:
+            breaker = self._breakers.setdefault(endpoint_class, CircuitBreaker())
+        return breaker
+
+    def circuit_status(self) -> Dict[str, Dict[str, Any]]:
+        """Estado do disjuntor de cada classe de endpoint já utilizada"""
+        return {name: breaker.status() for name, breaker in sorted(self._breakers.items())}
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """Estatísticas dos caches do cliente"""
+        return {
+            "metadados": self._metadata_cache.stats(),
+            "requisicoes_agrupadas": self._coalesced_requests,
+            "revalidacoes_em_andamento": len(self._revalidating),
+        }
+
+    async def aclose(self) -> None:
+        """Fecha o pool de conexões assíncrono"""
+        for task in list(self._background_tasks):
+            task.cancel()
+        if self._background_tasks:
+            await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    def _cache_lookup(self, endpoint: str, params: Optional[Dict],
+                      allow_stale: bool = False) -> Tuple[Optional[str], Any, bool]:
+        """Consulta o cache persistente; retorna (chave, resposta, vencida?).
+
+        Com ``allow_stale``, uma entrada vencida ainda dentro da janela de
+        stale-while-revalidate da classe do endpoint também é devolvida; cabe
+        a quem chama agendar a revalidação.
+        """
+        if self._response_cache is None:
+            return None, None, False
+        key = ResponseCache.make_key(endpoint, params)
+        endpoint_class = self._cache_class(endpoint)
+        try:
+            entry = self._response_cache.get_entry(key)
+        except (sqlite3.Error, ValueError) as exc:
+            logger.warning("Falha ao ler cache persistente: %s", exc)
+            entry = None
+        cached, stale, result = None, False, "miss"
+        if entry is not None:
+            age = time.time() - entry[1]
+            if age <= 0:
+                cached, result = entry[0], "hit"
+            elif allow_stale and STALE_WHILE_REVALIDATE and age < CACHE_STALE_WHILE_REVALIDATE.get(endpoint_class, 0):
+                cached, stale, result = entry[0], True, "stale"
+        self.metrics.observe_cache(endpoint_class, result)
+        return key, cached, stale
+
+    def _revalidate_in_background(self, cache_key: str, endpoint: str, params: Optional[Dict]) -> None:
+        """Atualiza uma entrada vencida do cache sem bloquear quem já a recebeu"""
+        if cache_key in self._revalidating:
+            return
+        self._revalidating.add(cache_key)
+
+        async def refresh() -> None:
+            request_priority.set(PRIORITY_BACKGROUND)
+            try:
+                await self._single_flight(
+                    cache_key, lambda: self._fetch_json_async(endpoint, params, cache_key)
+                )
+            except Exception as exc:
+                logger.warning("Falha ao revalidar %s em segundo plano: %s", endpoint, exc)
+            finally:
+                self._revalidating.discard(cache_key)
+
+        self._run_in_background(refresh())
+
+    def _run_in_background(self, coro: Coroutine[Any, Any, Any]) -> None:
+        """Executa a corrotina numa tarefa acompanhada (cancelada em ``aclose``)"""
+        task = asyncio.get_running_loop().create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    def _cache_class(self, endpoint: str) -> str:
+        """Classe do endpoint no cache: dados de períodos explícitos que incluem um
+        dos últimos períodos do agregado ficam em "variaveis_recentes" (validade curta)"""
+        endpoint_class = classify_endpoint(endpoint)
+        if endpoint_class == "variaveis":
+            match = re.match(r"/agregados/(\d+)/periodos/([^/]+)/variaveis/", endpoint)
+            if match and self.period_resolver.is_recent(int(match.group(1)), match.group(2)):
+                return "variaveis_recentes"
+        return endpoint_class
+
+    def _cache_store(self, key: Optional[str], endpoint: str, data: Any) -> None:
+        if self._response_cache is None or key is None:
+            return
+        try:
+            self._response_cache.set(key, self._cache_class(endpoint), data)
+        except sqlite3.Error as exc:
+            logger.warning("Falha ao gravar cache persistente: %s", exc)
+
+    def _record_request(self, request_id: int, endpoint: str, endpoint_class: str,
+                        attempt: int, status: Any, seconds: float, size: int = 0) -> None:
+        """Registra uma requisição HTTP nas métricas e, se habilitado, no log.
+
+        O log tem custo quase nulo abaixo do nível INFO; requisições bem-sucedidas
+        são amostradas por ``LOG_SAMPLE_RATE``, falhas são sempre registradas.
+        """
+        self.metrics.observe_request(endpoint_class, status, seconds, size)
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        failed = not isinstance(status, int) or status >= 400
+        if not failed and LOG_SAMPLE_RATE < 1 and random.random() >= LOG_SAMPLE_RATE:
+            return
+        logger.info(
+            "GET %s -> %s em %.1f ms (%d bytes, requisição %d, tentativa %d)",
+            endpoint, status, seconds * 1000, size, request_id, attempt + 1,
+            extra={"campos": {
+                "request_id": request_id,
+                "endpoint": endpoint,
+                "classe": endpoint_class,
+                "status": status,
+                "latencia_ms": round(seconds * 1000, 2),
+                "bytes": size,
+                "tentativa": attempt + 1,
+            }},
+        )
+
+    def _stale_fallback(self, cache_key: Optional[str], endpoint: str, exc: BaseException) -> Any:
+        """Resposta expirada do cache persistente, se a falha foi da API (5xx, timeout, disjuntor)"""
+        if self._response_cache is None or cache_key is None or not is_upstream_failure(exc):
+            return None
+        try:
+            stale = self._response_cache.get(cache_key, allow_stale=True)
+        except (sqlite3.Error, ValueError):
+            return None
+        if stale is not None:
+            logger.warning("API indisponível para %s (%s); usando resposta expirada do cache", endpoint, exc)
+        return stale
+
+    def _retry_or_raise(self, endpoint_class: str, url: str, attempt: int,
+                        exc: BaseException, retry_after: Optional[str] = None) -> float:
+        """Registra a falha no disjuntor e devolve a espera até a próxima tentativa.
+
+        Relança ``exc`` quando o erro não é transitório ou as tentativas acabaram.
+        """
+        if not is_upstream_failure(exc):
+            if isinstance(exc, (requests.exceptions.HTTPError, httpx.HTTPStatusError)):
+                # A API respondeu (ex: 404): não conta como indisponibilidade
+                self._breaker(endpoint_class).record_success()
+            raise exc
+        self._breaker(endpoint_class).record_failure()
+        if attempt + 1 >= self.retry_attempts:
+            raise exc
+        delay = retry_delay(attempt, retry_after)
+        self.metrics.observe_retry(endpoint_class)
+        logger.warning(
+            "Tentativa %d/%d para %s falhou (%s); nova tentativa em %.2fs",
+            attempt + 1, self.retry_attempts, url, exc, delay,
+        )
+        return delay
+
+    def _send(self, endpoint: str, params: Optional[Dict]) -> requests.Response:
+        """GET síncrono com novas tentativas e disjuntor"""
+        url = f"{self.base_url}{endpoint}"
+        endpoint_class = classify_endpoint(endpoint)
+        breaker = self._breaker(endpoint_class)
+        request_id = next(self._request_ids)
+        for attempt in range(self.retry_attempts):
+            if not breaker.allow():
+                raise CircuitOpenError(endpoint_class, breaker.retry_in())
+            self.rate_limiter.acquire_sync(endpoint_class)
+            started = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params, timeout=REQUEST_TIMEOUT)
+            except requests.exceptions.RequestException as e:
+                self._record_request(request_id, endpoint, endpoint_class, attempt,
+                                     type(e).__name__, time.perf_counter() - started)
+                time.sleep(self._retry_or_raise(endpoint_class, url, attempt, e))
+                continue
+            self._record_request(request_id, endpoint, endpoint_class, attempt, response.status_code,
+                                 time.perf_counter() - started, len(response.content))
+            try:
+                response.raise_for_status()
+            except requests.exceptions.HTTPError as e:
+                retry_after = response.headers.get("Retry-After")
+                time.sleep(self._retry_or_raise(endpoint_class, url, attempt, e, retry_after))
+                continue
+            breaker.record_success()
+            return response
+
     def _make_request(self, endpoint: str, params: Optional[Dict] = None) -> Dict[str, Any]:
         """Faz requisição para a API do IBGE"""
+        cache_key, cached, _ = self._cache_lookup(endpoint, params)
+        if cached is not None:
+            return cached
         try:
-            url = f"{self.base_url}{endpoint}"
-            logger.info(f"Fazendo requisição para: {url}")
-            response = self.session.get(url, params=params, timeout=30)
-            logger.info(f"Status code: {response.status_code}")
-            response.raise_for_status()
-            data = response.json()
-            logger.info(f"Resposta recebida: {type(data)} - {len(data) if isinstance(data, list) else 'não é lista'}")
+            response = self._send(endpoint, params)
+            data = json_codec.loads(response.content)
+            self._cache_store(cache_key, endpoint, data)
             return data
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Erro na requisição para {endpoint}: {e}")
+        except (requests.exceptions.RequestException, CircuitOpenError) as e:
+            stale = self._stale_fallback(cache_key, endpoint, e)
+            if stale is not None:
+                return stale
+            logger.error("Erro na requisição para %s: %s", endpoint, e)
             raise Exception(f"Erro ao acessar API do IBGE: {e}")
+        except ValueError as e:
+            raise Exception(f"Resposta inválida da API do IBGE: {e}")
     
     def get_agregados(self, **filters) -> List[Dict[str, Any]]:
         """Obtém lista de agregados com filtros opcionais"""
@@ -72,12 +1728,17 @@ class IBGEAPIClient:
     def get_agregado_metadados(self, agregado_id: int) -> Dict[str, Any]:
         """Obtém metadados de um agregado específico"""
         cache_key = str(agregado_id)
-        if cache_key in self._metadata_cache:
-            self._cache_stats["hits"] += 1
-            return self._metadata_cache[cache_key]
+        cached = self._metadata_cache.get(cache_key)
+        if cached is not None:
+            return cached
 
-        self._cache_stats["misses"] += 1
         data = self._make_request(f"/agregados/{agregado_id}/metadados")
+        data = self._normalize_metadados(agregado_id, data)
+        self._metadata_cache.set(cache_key, data)
+        return data
+
+    @staticmethod
+    def _normalize_metadados(agregado_id: int, data: Any) -> Dict[str, Any]:
         # A API do IBGE às vezes responde com uma lista contendo um único item;
         # normalizamos para sempre trabalhar com um dicionário.
         if isinstance(data, list):
@@ -88,7 +1749,6 @@ class IBGEAPIClient:
             raise Exception(
                 f"Formato inesperado de metadados ({type(data).__name__}) para agregado {agregado_id}"
             )
-        self._metadata_cache[cache_key] = data
         return data
     
     def get_localidades(self, agregado_id: int, nivel: str) -> List[Dict[str, Any]]:
@@ -103,7 +1763,15 @@ class IBGEAPIClient:
                      localidades: str = "BR", periodos: Optional[str] = None,
                      classificacao: Optional[str] = None, view: str = "default") -> List[Dict[str, Any]]:
         """Obtém dados das variáveis de um agregado"""
-        
+        endpoint, params = self._variaveis_request(
+            agregado_id, variavel, localidades, periodos, classificacao, view
+        )
+        return self._make_request(endpoint, params=params)
+
+    @staticmethod
+    def _variaveis_request(agregado_id: int, variavel: str, localidades: str,
+                           periodos: Optional[str], classificacao: Optional[str],
+                           view: str) -> Tuple[str, Dict[str, Any]]:
         # Construir endpoint baseado se períodos foi especificado
         if periodos:
             endpoint = f"/agregados/{agregado_id}/periodos/{periodos}/variaveis/{variavel}"
@@ -116,237 +1784,1589 @@ class IBGEAPIClient:
             params["classificacao"] = classificacao
         if view and view != "default":
             params["view"] = view
-            
-        return self._make_request(endpoint, params=params)
+        return endpoint, params
+
+    # ------------------------------------------------------------------
+    # Modo assíncrono: mesmas operações sobre o pool httpx compartilhado
+    # ------------------------------------------------------------------
+
+    async def _fetch_async(self, endpoint: str, params: Optional[Dict] = None,
+                           headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+        url = f"{self.base_url}{endpoint}"
+        client = self._get_async_client()
+        endpoint_class = classify_endpoint(endpoint)
+        breaker = self._breaker(endpoint_class)
+        request_id = next(self._request_ids)
+        for attempt in range(self.retry_attempts):
+            if not breaker.allow():
+                raise CircuitOpenError(endpoint_class, breaker.retry_in())
+            await self.rate_limiter.acquire(endpoint_class)
+            # O semáforo do host é liberado durante a espera entre tentativas
+            async with self._host_semaphore(url):
+                started = time.perf_counter()
+                try:
+                    response = await client.get(url, params=params, headers=headers)
+                except httpx.HTTPError as e:
+                    self._record_request(request_id, endpoint, endpoint_class, attempt,
+                                         type(e).__name__, time.perf_counter() - started)
+                    delay = self._retry_or_raise(endpoint_class, url, attempt, e)
+                    response = None
+            if response is None:
+                await asyncio.sleep(delay)
+                continue
+            self._record_request(request_id, endpoint, endpoint_class, attempt, response.status_code,
+                                 time.perf_counter() - started, len(response.content))
+            if response.status_code != 304:
+                try:
+                    response.raise_for_status()
+                except httpx.HTTPStatusError as e:
+                    retry_after = response.headers.get("Retry-After")
+                    await asyncio.sleep(self._retry_or_raise(endpoint_class, url, attempt, e, retry_after))
+                    continue
+            breaker.record_success()
+            return response
+
+    async def _single_flight(self, key: str, factory) -> Any:
+        """Executa ``factory`` uma única vez por chave entre chamadas concorrentes.
+
+        A requisição roda em uma tarefa própria compartilhada por todos os
+        interessados (que recebem o mesmo objeto decodificado, que não deve ser
+        modificado): cancelar quem a iniciou não cancela os demais. A tarefa usa
+        a maior prioridade entre os interessados: uma chamada interativa que se
+        junta a uma requisição de segundo plano a eleva no limitador de taxa.
+        """
+        priority = current_priority()
+        task = self._inflight.get(key)
+        if task is not None:
+            self._coalesced_requests += 1
+            holder = self._flight_priorities[key]
+            holder[0] = min(holder[0], priority[0])
+        else:
+            # Requisições aninhadas compartilham a prioridade da que as originou
+            holder = priority if flight_priority.get() is not None else [priority[0]]
+
+            async def run() -> Any:
+                flight_priority.set(holder)
+                return await factory()
+
+            task = asyncio.get_running_loop().create_task(run())
+            self._inflight[key] = task
+            self._flight_priorities[key] = holder
+            self._background_tasks.add(task)
+
+            def done(finished: asyncio.Task) -> None:
+                if self._inflight.get(key) is finished:
+                    del self._inflight[key]
+                    del self._flight_priorities[key]
+                self._background_tasks.discard(finished)
+                if not finished.cancelled():
+                    finished.exception()  # evita aviso de exceção não recuperada sem aguardantes
+
+            task.add_done_callback(done)
+        return await asyncio.shield(task)
+
+    async def _make_request_async(self, endpoint: str, params: Optional[Dict] = None) -> Any:
+        """Faz requisição assíncrona para a API do IBGE"""
+        cache_key, cached, stale = self._cache_lookup(endpoint, params, allow_stale=True)
+        if cached is not None:
+            if stale:
+                self._revalidate_in_background(cache_key, endpoint, params)
+            return cached
+        return await self._single_flight(
+            cache_key or ResponseCache.make_key(endpoint, params),
+            lambda: self._fetch_json_async(endpoint, params, cache_key),
+        )
+
+    async def _fetch_json_async(self, endpoint: str, params: Optional[Dict],
+                                cache_key: Optional[str]) -> Any:
+        try:
+            response = await self._fetch_async(endpoint, params)
+            data = json_codec.loads(response.content)
+            self._cache_store(cache_key, endpoint, data)
+            return data
+        except (httpx.HTTPError, CircuitOpenError) as e:
+            stale = self._stale_fallback(cache_key, endpoint, e)
+            if stale is not None:
+                return stale
+            logger.error("Erro na requisição para %s: %s", endpoint, e)
+            raise Exception(f"Erro ao acessar API do IBGE: {e}")
+        except ValueError as e:
+            raise Exception(f"Resposta inválida da API do IBGE: {e}")
+
+    async def get_agregados_async(self, **filters) -> List[Dict[str, Any]]:
+        """Versão assíncrona de get_agregados"""
+        return await self._make_request_async("/agregados", params=filters)
+
+    async def iter_variaveis_async(self, agregado_id: int, variavel: str = "all",
+                                   localidades: str = "BR", periodos: Optional[str] = None,
+                                   classificacao: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Itera as séries de get_variaveis à medida que a resposta chega (memória limitada)"""
+        endpoint, params = self._variaveis_request(
+            agregado_id, variavel, localidades, periodos, classificacao, "default"
+        )
+        cache_key, cached, stale = self._cache_lookup(endpoint, params, allow_stale=True)
+        if cached is not None:
+            if stale:
+                self._revalidate_in_background(cache_key, endpoint, params)
+            for row in iter_variaveis_rows(cached):
+                yield row
+            return
+
+        url = f"{self.base_url}{endpoint}"
+        parser = VariaveisStreamParser()
+        endpoint_class = classify_endpoint(endpoint)
+        breaker = self._breaker(endpoint_class)
+        request_id = next(self._request_ids)
+        received = 0
+        try:
+            client = self._get_async_client()
+            for attempt in range(self.retry_attempts):
+                if not breaker.allow():
+                    raise CircuitOpenError(endpoint_class, breaker.retry_in())
+                await self.rate_limiter.acquire(endpoint_class)
+                started = time.perf_counter()
+                status: Any = "incompleto"
+                retry_after = None
+                try:
+                    async with self._host_semaphore(url):
+                        async with client.stream("GET", url, params=params) as response:
+                            status = response.status_code
+                            retry_after = response.headers.get("Retry-After")
+                            response.raise_for_status()
+                            breaker.record_success()
+                            async for chunk in response.aiter_bytes():
+                                received += len(chunk)
+                                for row in parser.feed(chunk):
+                                    yield row
+                except httpx.HTTPError as e:
+                    if not isinstance(e, httpx.HTTPStatusError):
+                        status = type(e).__name__
+                    if received:
+                        # Linhas já entregues: não há como repetir sem duplicá-las
+                        raise
+                    delay = self._retry_or_raise(endpoint_class, url, attempt, e, retry_after)
+                else:
+                    break
+                finally:
+                    # Inclui streams encerrados antes do fim (ex: página completa)
+                    self._record_request(request_id, endpoint, endpoint_class, attempt, status,
+                                         time.perf_counter() - started, received)
+                await asyncio.sleep(delay)
+            for row in parser.close():
+                yield row
+        except (httpx.HTTPError, CircuitOpenError) as e:
+            stale = None if received else self._stale_fallback(cache_key, endpoint, e)
+            if stale is not None:
+                for row in iter_variaveis_rows(stale):
+                    yield row
+                return
+            logger.error("Erro na requisição para %s: %s", endpoint, e)
+            raise Exception(f"Erro ao acessar API do IBGE: {e}")
+        except ValueError as e:
+            raise Exception(f"Resposta inválida da API do IBGE: {e}")
+
+    async def get_agregados_conditional_async(
+        self,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        **filters,
+    ) -> Tuple[Optional[List[Dict[str, Any]]], Dict[str, Optional[str]]]:
+        """Revalida o catálogo via ETag/Last-Modified; retorna (None, validadores) se não mudou"""
+        headers: Dict[str, str] = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        try:
+            response = await self._fetch_async("/agregados", params=filters, headers=headers)
+            validators = {
+                "etag": response.headers.get("ETag") or etag,
+                "last_modified": response.headers.get("Last-Modified") or last_modified,
+            }
+            if response.status_code == 304:
+                return None, validators
+            data = json_codec.loads(response.content)
+        except (httpx.HTTPError, CircuitOpenError) as e:
+            logger.error("Erro na requisição para /agregados: %s", e)
+            raise Exception(f"Erro ao acessar API do IBGE: {e}")
+        self._cache_store(ResponseCache.make_key("/agregados", filters), "/agregados", data)
+        return data, validators
+
+    async def get_agregado_metadados_async(self, agregado_id: int) -> Dict[str, Any]:
+        """Versão assíncrona de get_agregado_metadados (compartilha o mesmo cache)"""
+        cache_key = str(agregado_id)
+        cached = self._metadata_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        async def fetch() -> Dict[str, Any]:
+            data = await self._make_request_async(f"/agregados/{agregado_id}/metadados")
+            data = self._normalize_metadados(agregado_id, data)
+            self._metadata_cache.set(cache_key, data)
+            return data
+
+        return await self._single_flight(f"metadados:{cache_key}", fetch)
+
+    async def get_localidades_async(self, agregado_id: int, nivel: str) -> List[Dict[str, Any]]:
+        """Versão assíncrona de get_localidades"""
+        return await self._make_request_async(f"/agregados/{agregado_id}/localidades/{nivel}")
+
+    async def get_periodos_async(self, agregado_id: int) -> List[Dict[str, Any]]:
+        """Versão assíncrona de get_periodos"""
+        return await self._make_request_async(f"/agregados/{agregado_id}/periodos")
+
+    async def refresh_periodos_async(self, agregado_id: int) -> List[Dict[str, Any]]:
+        """Busca a lista de períodos direto na API (ignorando o cache) e atualiza o cache"""
+        endpoint = f"/agregados/{agregado_id}/periodos"
+        cache_key = ResponseCache.make_key(endpoint, None)
+        return await self._single_flight(
+            cache_key, lambda: self._fetch_json_async(endpoint, None, cache_key)
+        )
+
+    def cached_periodos(self, agregado_id: int) -> Optional[Tuple[float, List[Dict[str, Any]]]]:
+        """Idade (em segundos) e conteúdo da lista de períodos no cache persistente, mesmo vencida"""
+        if self._response_cache is None:
+            return None
+        key = ResponseCache.make_key(f"/agregados/{agregado_id}/periodos", None)
+        try:
+            entry = self._response_cache.get_entry(key)
+        except (sqlite3.Error, ValueError) as exc:
+            logger.warning("Falha ao ler cache persistente: %s", exc)
+            return None
+        if entry is None:
+            return None
+        return max(0.0, time.time() - entry[2]), entry[0]
+
+    async def resolve_periodos_async(self, agregado_id: int,
+                                     periodos: Optional[str]) -> Optional[List[str]]:
+        """Resolve a expressão de períodos em IDs concretos (ver PeriodResolver).
+
+        Expressões relativas ou com intervalos esperam a lista de períodos
+        atualizada. IDs explícitos não esperam: a lista disponível define quais
+        deles são recentes no cache e é renovada em segundo plano. Expressões
+        inválidas levantam ValueError; se a lista não puder ser obtida, retorna
+        None e a expressão segue como está para a API.
+        """
+        termos = parse_period_expression(periodos) if periodos else []
+        if termos and all(termo[0] == "periodo" for termo in termos):
+            self.period_resolver.revalidate(agregado_id)
+            return await self.period_resolver.resolve(agregado_id, periodos)
+        try:
+            await self.period_resolver.ids(agregado_id)
+        except Exception as exc:
+            logger.warning("Não foi possível obter os períodos do agregado %s: %s", agregado_id, exc)
+            return None
+        return await self.period_resolver.resolve(agregado_id, periodos)
+
+    def _variaveis_em_cache(self, agregado_id: int, variavel: str, localidades: str,
+                            lista_periodos: List[str],
+                            classificacao: Optional[str]) -> Tuple[Dict[str, Any], List[str]]:
+        """Separa os períodos com resposta no cache (chave por período) dos que faltam"""
+        encontrados: Dict[str, Any] = {}
+        faltando: List[str] = []
+        for periodo in lista_periodos:
+            endpoint, params = self._variaveis_request(
+                agregado_id, variavel, localidades, periodo, classificacao, "default"
+            )
+            cache_key, cached, stale = self._cache_lookup(endpoint, params, allow_stale=True)
+            if cached is None:
+                faltando.append(periodo)
+                continue
+            if stale:
+                self._revalidate_in_background(cache_key, endpoint, params)
+            encontrados[periodo] = cached
+        return encontrados, faltando
+
+    async def _get_variaveis_por_periodo_async(self, agregado_id: int, variavel: str,
+                                               localidades: str, lista_periodos: List[str],
+                                               classificacao: Optional[str]) -> List[Dict[str, Any]]:
+        """Consulta períodos já resolvidos guardando cada período sob a própria chave.
+
+        Consultas que se sobrepõem (ex: "-6" antes e depois de uma nova
+        divulgação) buscam na API apenas os períodos que ainda não estão no cache.
+        """
+        partes, faltando = self._variaveis_em_cache(
+            agregado_id, variavel, localidades, lista_periodos, classificacao
+        )
+        if faltando:
+            expressao = "|".join(faltando)
+            try:
+                chunks = await self._plan_variaveis_chunks(
+                    agregado_id, variavel, localidades, expressao, classificacao
+                )
+            except Exception as exc:
+                logger.warning("Não foi possível estimar o tamanho da consulta: %s", exc)
+                chunks = []
+            if len(chunks) > 1:
+                logger.info(
+                    "Consulta ao agregado %s dividida em %s partes", agregado_id, len(chunks)
+                )
+            if not chunks:
+                chunks = [(expressao, localidades)]
+
+            # Uma consulta de um único período sem divisão é guardada (e recuperada
+            # em falhas da API) pelo próprio _fetch_json_async
+            direto = len(chunks) == 1 and len(faltando) == 1
+
+            async def buscar(chunk_periodos: str, chunk_localidades: str) -> Any:
+                endpoint, params = self._variaveis_request(
+                    agregado_id, variavel, chunk_localidades, chunk_periodos, classificacao, "default"
+                )
+                cache_key = ResponseCache.make_key(endpoint, params)
+                return await self._single_flight(cache_key, lambda: self._fetch_json_async(
+                    endpoint, params, cache_key if direto else None
+                ))
+
+            respostas = await asyncio.gather(*(buscar(p, l) for p, l in chunks))
+            novos = respostas[0] if len(respostas) == 1 else merge_variaveis(respostas)
+            if direto:
+                partes[faltando[0]] = novos
+            else:
+                por_periodo = split_variaveis_por_periodo(novos)
+                for periodo in faltando:
+                    dados = por_periodo.get(periodo)
+                    if not dados:
+                        continue
+                    partes[periodo] = dados
+                    endpoint, params = self._variaveis_request(
+                        agregado_id, variavel, localidades, periodo, classificacao, "default"
+                    )
+                    self._cache_store(ResponseCache.make_key(endpoint, params), endpoint, dados)
+
+        if len(lista_periodos) == 1:
+            return partes.get(lista_periodos[0], [])
+        return merge_variaveis([partes[p] for p in lista_periodos if p in partes])
+
+    async def get_variaveis_async(self, agregado_id: int, variavel: str = "all",
+                                  localidades: str = "BR", periodos: Optional[str] = None,
+                                  classificacao: Optional[str] = None,
+                                  view: str = "default") -> List[Dict[str, Any]]:
+        """Versão assíncrona de get_variaveis.
+
+        Os períodos são resolvidos localmente em IDs concretos e cada período é
+        guardado no cache separadamente. Consultas que excedem o limite de
+        MAX_VALUES_LIMIT valores da API são divididas em partes (por períodos e,
+        se preciso, por localidades), executadas em paralelo e mescladas no
+        formato original.
+        """
+        if not view or view == "default":
+            lista_periodos = await self.resolve_periodos_async(agregado_id, periodos)
+            if lista_periodos is not None:
+                return await self._get_variaveis_por_periodo_async(
+                    agregado_id, variavel, localidades, lista_periodos, classificacao
+                )
+            try:
+                chunks = await self._plan_variaveis_chunks(
+                    agregado_id, variavel, localidades, periodos, classificacao
+                )
+            except Exception as exc:
+                logger.warning("Não foi possível estimar o tamanho da consulta: %s", exc)
+                chunks = []
+            if len(chunks) > 1:
+                logger.info(
+                    "Consulta ao agregado %s dividida em %s partes", agregado_id, len(chunks)
+                )
+                partes = await asyncio.gather(*(
+                    self._make_request_async(*self._variaveis_request(
+                        agregado_id, variavel, chunk_localidades, chunk_periodos,
+                        classificacao, view
+                    ))
+                    for chunk_periodos, chunk_localidades in chunks
+                ))
+                return merge_variaveis(partes)
+        elif periodos:
+            # Valida a expressão e carrega a lista que classifica os períodos no cache
+            await self.resolve_periodos_async(agregado_id, periodos)
+
+        endpoint, params = self._variaveis_request(
+            agregado_id, variavel, localidades, periodos, classificacao, view
+        )
+        return await self._make_request_async(endpoint, params=params)
+
+    async def get_variaveis_table_async(self, agregado_id: int, variavel: str = "all",
+                                        localidades: str = "BR", periodos: Optional[str] = None,
+                                        classificacao: Optional[str] = None) -> VariaveisTable:
+        """Obtém os dados das variáveis direto em formato colunar (VariaveisTable).
+
+        As partes da consulta são lidas em streaming e concorrentemente para a
+        mesma tabela, sem materializar a resposta aninhada. Períodos já guardados
+        no cache (por período) são lidos de lá; só os demais são buscados.
+        """
+        table = VariaveisTable()
+        lista_periodos = await self.resolve_periodos_async(agregado_id, periodos)
+        if lista_periodos is not None:
+            encontrados, faltando = self._variaveis_em_cache(
+                agregado_id, variavel, localidades, lista_periodos, classificacao
+            )
+            for periodo in lista_periodos:
+                for row in iter_variaveis_rows(encontrados.get(periodo, [])):
+                    table.append_row(row)
+            if not faltando:
+                return table
+            periodos = "|".join(faltando)
+
+        try:
+            chunks = await self._plan_variaveis_chunks(
+                agregado_id, variavel, localidades, periodos, classificacao
+            )
+        except Exception as exc:
+            logger.warning("Não foi possível estimar o tamanho da consulta: %s", exc)
+            chunks = []
+        if not chunks:
+            chunks = [(periodos, localidades)]
+
+        async def consumir(chunk_periodos: Optional[str], chunk_localidades: str) -> None:
+            async for row in self.iter_variaveis_async(
+                agregado_id, variavel, chunk_localidades, chunk_periodos, classificacao
+            ):
+                table.append_row(row)
+
+        await asyncio.gather(*(consumir(p, l) for p, l in chunks))
+        return table
+
+    async def plan_variaveis_async(self, agregado_id: int, variavel: str, localidades: str,
+                                   periodos: Optional[str], classificacao: Optional[str],
+                                   max_series: Optional[int] = None) -> List[Tuple[Optional[str], str]]:
+        """Partes (periodos, localidades) da consulta, em ordem; uma só se couber no limite.
+
+        Com ``max_series``, as localidades são fatiadas para que cada parte traga
+        no máximo cerca de ``max_series`` séries (uma página).
+        """
+        try:
+            chunks = await self._plan_variaveis_chunks(
+                agregado_id, variavel, localidades, periodos, classificacao, max_series
+            )
+        except ValueError:
+            raise
+        except Exception as exc:
+            logger.warning("Não foi possível estimar o tamanho da consulta: %s", exc)
+            chunks = []
+        return chunks or [(periodos, localidades)]
+
+    async def _expand_localidades_async(self, agregado_id: int,
+                                        localidades: str) -> List[Tuple[str, Optional[List[str]], int]]:
+        """Divide a expressão de localidades em grupos (nível, IDs explícitos ou None, estimativa).
+
+        Só grupos com IDs explícitos podem ser divididos entre requisições; "BR",
+        seleções hierárquicas (ex: N6[N3[35]]) e expressões desconhecidas seguem
+        inteiras (no lugar do nível vai a expressão completa), com a estimativa
+        usada apenas para dimensionar a consulta.
+        """
+        grupos: List[Tuple[str, Optional[List[str]], int]] = []
+        for grupo in localidades.split("|"):
+            grupo = grupo.strip()
+            match = re.fullmatch(r"(N\d+)\[(.*)\]", grupo)
+            if match is None:
+                grupos.append((grupo, None, 1))  # "BR" ou expressão desconhecida: um único item
+                continue
+            nivel, itens = match.groups()
+            if itens.lower() == "all":
+                todas = await self.get_localidades_async(agregado_id, nivel)
+                grupos.append((nivel, [str(loc.get("id")) for loc in todas], len(todas)))
+            elif "[" in itens:
+                # O nível inteiro é um teto para a seleção hierárquica, não a seleção em si
+                todas = await self.get_localidades_async(agregado_id, nivel)
+                grupos.append((grupo, None, max(1, len(todas))))
+            else:
+                ids = [item.strip() for item in itens.split(",") if item.strip()]
+                grupos.append((nivel, ids, len(ids)))
+        return grupos
+
+    async def _plan_variaveis_chunks(self, agregado_id: int, variavel: str, localidades: str,
+                                     periodos: Optional[str], classificacao: Optional[str],
+                                     max_series: Optional[int] = None) -> List[Tuple[str, str]]:
+        """Planeja partes (periodos, localidades) que respeitam MAX_VALUES_LIMIT.
+
+        Retorna lista vazia quando a consulta cabe em uma única requisição (e,
+        com ``max_series``, em uma única página).
+        """
+        metadados = await self.get_agregado_metadados_async(agregado_id)
+
+        if variavel == "all":
+            n_variaveis = max(1, len(metadados.get("variaveis", [])))
+        else:
+            n_variaveis = len([v for v in variavel.split("|") if v])
+
+        n_categorias = 1
+        categorias_por_classificacao = {
+            str(c.get("id")): len(c.get("categorias", [])) for c in metadados.get("classificacoes", [])
+        }
+        for item in (classificacao or "").split("|"):
+            match = re.fullmatch(r"(\d+)\[(.*)\]", item.strip())
+            if match is None:
+                continue
+            class_id, categorias = match.groups()
+            if categorias.lower() in ("all", "allxt"):
+                n_categorias *= max(1, categorias_por_classificacao.get(class_id, 1))
+            else:
+                n_categorias *= max(1, len([c for c in categorias.split(",") if c]))
+
+        # Estimativa barata antes de buscar períodos e localidades
+        termos = parse_period_expression(periodos) if periodos else []
+        if termos and all(termo[0] == "periodo" for termo in termos):
+            n_periodos = len(termos)
+        else:
+            n_periodos = None
+        grupos_localidades = await self._expand_localidades_async(agregado_id, localidades)
+        n_localidades = sum(estimativa for _, _, estimativa in grupos_localidades)
+        por_localidade = n_variaveis * n_categorias
+        por_periodo = por_localidade * n_localidades
+        if max_series is not None and por_periodo > max_series:
+            return await self._plan_variaveis_pages(
+                agregado_id, periodos, grupos_localidades, por_localidade, max_series
+            )
+        if n_periodos is not None and por_periodo * n_periodos <= MAX_VALUES_LIMIT:
+            return []
+
+        lista_periodos = await self.period_resolver.resolve(agregado_id, periodos)
+        if por_periodo * len(lista_periodos) <= MAX_VALUES_LIMIT:
+            return []
+
+        if por_periodo <= MAX_VALUES_LIMIT:
+            # Basta dividir por períodos
+            por_parte = max(1, MAX_VALUES_LIMIT // por_periodo)
+            return [
+                ("|".join(lista_periodos[i:i + por_parte]), localidades)
+                for i in range(0, len(lista_periodos), por_parte)
+            ]
+
+        # Um único período já excede o limite: divide também as localidades
+        max_localidades = max(1, min(MAX_LOCALIDADES_PER_REQUEST, MAX_VALUES_LIMIT // por_localidade))
+        partes_localidades: List[str] = []
+        for nivel, ids, _ in grupos_localidades:
+            if ids is None:
+                # Grupo indivisível: segue inteiro, dividido apenas por período
+                partes_localidades.append(nivel)
+                continue
+            for i in range(0, len(ids), max_localidades):
+                partes_localidades.append(f"{nivel}[{','.join(ids[i:i + max_localidades])}]")
+        return [(periodo, parte) for periodo in lista_periodos for parte in partes_localidades]
+
+    async def _plan_variaveis_pages(self, agregado_id: int, periodos: Optional[str],
+                                    grupos_localidades: List[Tuple[str, Optional[List[str]], int]],
+                                    por_localidade: int, max_series: int) -> List[Tuple[str, str]]:
+        """Partes para a paginação: fatias de localidades com cerca de uma página de séries.
+
+        Cada fatia traz todos os períodos de uma vez (divididos só se excederem
+        MAX_VALUES_LIMIT), de modo que cada página corresponde a uma requisição
+        e nenhuma página precisa reler as séries das anteriores.
+        """
+        lista_periodos = await self.period_resolver.resolve(agregado_id, periodos)
+        por_fatia = max(1, min(MAX_LOCALIDADES_PER_REQUEST, max_series // por_localidade))
+        partes: List[Tuple[str, str]] = []
+        for nivel, ids, estimativa in grupos_localidades:
+            if ids is None:
+                fatias = [(nivel, estimativa)]
+            else:
+                fatias = [
+                    (f"{nivel}[{','.join(ids[i:i + por_fatia])}]", len(ids[i:i + por_fatia]))
+                    for i in range(0, len(ids), por_fatia)
+                ]
+            for fatia, n_localidades in fatias:
+                por_parte = max(1, MAX_VALUES_LIMIT // (por_localidade * max(1, n_localidades)))
+                for i in range(0, len(lista_periodos), por_parte):
+                    partes.append(("|".join(lista_periodos[i:i + por_parte]), fatia))
+        return partes
+
+class CatalogStore:
+    """Catálogo de agregados mantido em memória e revalidado periodicamente.
+
+    Cada combinação de filtros de ``/agregados`` é uma visão independente. Uma
+    visão é servida da memória até vencer o intervalo de atualização; depois
+    disso é revalidada com ETag/Last-Modified, e só é baixada de novo quando
+    o servidor indica que o conteúdo mudou. Até ``max_staleness`` segundos
+    após vencer, a visão ainda é devolvida de imediato e revalidada em
+    segundo plano.
+    """
+
+    def __init__(self, client: IBGEAPIClient, refresh_interval: float = CATALOG_REFRESH_INTERVAL,
+                 max_staleness: Optional[float] = None):
+        self.client = client
+        self.refresh_interval = refresh_interval
+        if max_staleness is None:
+            max_staleness = CACHE_STALE_WHILE_REVALIDATE["catalogo"] if STALE_WHILE_REVALIDATE else 0.0
+        self.max_staleness = max_staleness
+        self._views: Dict[str, Dict[str, Any]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._refreshing: Dict[str, asyncio.Task] = {}
+
+    async def get(self, **filters) -> List[Dict[str, Any]]:
+        """Retorna o catálogo (ou a visão filtrada), revalidando quando vencido"""
+        filters = {k: v for k, v in filters.items() if v is not None}
+        key = ResponseCache.make_key("/agregados", filters)
+        view = self._views.get(key)
+        if view is not None:
+            age = time.monotonic() - view["checked_at"]
+            if age < self.refresh_interval:
+                return view["data"]
+            if age < self.refresh_interval + self.max_staleness:
+                self._refresh_in_background(key, filters)
+                return view["data"]
+        return await self._refresh(key, filters)
+
+    def _refresh_in_background(self, key: str, filters: Dict[str, Any]) -> None:
+        if key in self._refreshing:
+            return
+
+        async def refresh() -> None:
+            request_priority.set(PRIORITY_BACKGROUND)
+            try:
+                await self._refresh(key, filters)
+            except Exception as exc:
+                logger.warning("Falha ao revalidar catálogo (%s) em segundo plano: %s", key, exc)
+            finally:
+                self._refreshing.pop(key, None)
+
+        self._refreshing[key] = asyncio.get_running_loop().create_task(refresh())
+
+    async def _refresh(self, key: str, filters: Dict[str, Any]) -> List[Dict[str, Any]]:
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            view = self._views.get(key)
+            if view is not None and time.monotonic() - view["checked_at"] < self.refresh_interval:
+                return view["data"]
+
+            if view is None:
+                # Primeira carga do processo: aproveita o cache persistente, se houver
+                _, cached, stale = self.client._cache_lookup("/agregados", filters, allow_stale=True)
+                if cached is not None:
+                    view = {"data": cached, "etag": None, "last_modified": None}
+                    # Cópia vencida: já conta como vencida para ser revalidada
+                    view["checked_at"] = time.monotonic() - (self.refresh_interval if stale else 0)
+                    self._views[key] = view
+                    if stale:
+                        self._refresh_in_background(key, filters)
+                    return cached
+
+            try:
+                data, validators = await self.client.get_agregados_conditional_async(
+                    etag=view.get("etag") if view else None,
+                    last_modified=view.get("last_modified") if view else None,
+                    **filters,
+                )
+            except Exception as exc:
+                if view is None:
+                    raise
+                logger.warning("Falha ao revalidar catálogo (%s); usando cópia em memória: %s", key, exc)
+                view["checked_at"] = time.monotonic()
+                return view["data"]
+
+            if data is None and view is not None:
+                logger.info("Catálogo %s inalterado (304)", key)
+                view.update(validators)
+            else:
+                view = {"data": data or [], **validators}
+                self._views[key] = view
+            view["checked_at"] = time.monotonic()
+            return view["data"]
+
+    def invalidate(self) -> None:
+        """Força a revalidação de todas as visões na próxima consulta"""
+        for view in self._views.values():
+            view["checked_at"] = float("-inf")
+
+
+def period_year(value: Any) -> Optional[int]:
+    """Ano de um período do IBGE (2020, 202001, "202001"...)"""
+    digits = re.match(r"\d{4}", str(value or "").strip())
+    return int(digits.group(0)) if digits else None
+
+
+class PeriodIntervalTree:
+    """Árvore de intervalos estática sobre os anos cobertos por cada agregado.
+
+    Os intervalos ficam num vetor ordenado pelo início, tratado como árvore
+    binária balanceada implícita; cada nó guarda o maior fim da sua subárvore,
+    o que permite descartar subárvores inteiras ao buscar sobreposições.
+    """
+
+    def __init__(self, intervals: List[Tuple[int, int, str]]):
+        self._items = sorted(intervals)
+        self._max_end = [0] * len(self._items)
+        self._build(0, len(self._items))
+
+    def _build(self, lo: int, hi: int) -> float:
+        if lo >= hi:
+            return float("-inf")
+        mid = (lo + hi) // 2
+        max_end = max(self._items[mid][1], self._build(lo, mid), self._build(mid + 1, hi))
+        self._max_end[mid] = max_end
+        return max_end
+
+    def overlapping(self, start: float, end: float) -> Set[str]:
+        """Agregados cujo intervalo [início, fim] cruza [start, end]"""
+        found: Set[str] = set()
+        self._query(0, len(self._items), start, end, found)
+        return found
+
+    def _query(self, lo: int, hi: int, start: float, end: float, found: Set[str]) -> None:
+        if lo >= hi:
+            return
+        mid = (lo + hi) // 2
+        if self._max_end[mid] < start:
+            return
+        self._query(lo, mid, start, end, found)
+        item_start, item_end, agregado_id = self._items[mid]
+        if item_start <= end:
+            if item_end >= start:
+                found.add(agregado_id)
+            self._query(mid + 1, hi, start, end, found)
+
 
 class AgregadoSearchIndex:
-    """Índice local para agilizar buscas por agregados usando termos enriquecidos."""
+    """Índice local para agilizar buscas por agregados usando termos enriquecidos.
+
+    O índice é persistido em um arquivo binário versionado e append-only:
+    registros ``T`` acrescentam termos a uma tabela de strings internadas,
+    registros ``E`` gravam uma entrada completa como listas de IDs inteiros
+    de termos por campo e registros ``S`` guardam o resumo dos metadados do
+    agregado (JSON compacto). Cada gravação anexa apenas termos novos e
+    entradas alteradas; o arquivo é compactado quando os registros obsoletos
+    passam a dominar.
+
+    Os termos normalizados de cada agregado alimentam um índice invertido
+    (token -> agregados) e um índice de trigramas sobre o vocabulário
+    (trigrama -> tokens), usado para resolver buscas por substring sem
+    percorrer todos os agregados. Os termos são guardados por campo
+    (agregado, pesquisa, variável, classificação...) e as frequências nas
+    postings já vêm ponderadas pelo peso do campo, para ranqueamento BM25F.
+
+    Os resumos alimentam ainda índices por atributo (nível territorial ->
+    agregados, periodicidade -> agregados e uma árvore de intervalos dos
+    anos cobertos), reconstruídos sob demanda quando algum resumo muda.
+    """
 
     def __init__(
         self,
         client: IBGEAPIClient,
         cache_filename: Optional[str] = None,
-        max_metadata_per_search: int = 25,
     ):
         self.client = client
-        self.max_metadata_per_search = max_metadata_per_search
         self.cache_path = (
             Path(cache_filename)
             if cache_filename
-            else Path(__file__).with_name("ibge_agregado_index_cache.json")
+            else Path(__file__).with_name("ibge_agregado_index_cache.bin")
         )
+        # Índices JSON de versões anteriores são importados na primeira carga
+        self.legacy_json_path = self.cache_path.with_suffix(".json")
         self.index: Dict[str, Dict[str, Any]] = {}
+        self._terms: List[str] = []
+        self._term_ids: Dict[str, int] = {}
+        self._persisted_terms = 0
+        self._persisted_records = 0
+        self._dirty: Set[str] = set()
+        self._needs_rewrite = False
+        self._postings: Dict[str, Dict[str, float]] = {}
+        self._trigrams: Dict[str, Set[str]] = {}
+        self._doc_lengths: Dict[str, float] = {}
+        self._total_length = 0.0
+        self._catalog_info: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+        self._indexed_catalog: Optional[List[Dict[str, Any]]] = None
+        self._attributes: Optional[Dict[str, Any]] = None
         self._loaded = False
 
     @staticmethod
     def _normalize_text(value: str) -> str:
-        if not value:
-            return ""
-        normalized = unicodedata.normalize("NFKD", value)
-        ascii_text = normalized.encode("ASCII", "ignore").decode("ASCII")
-        return ascii_text.lower().strip()
+        return normalize_text(value)
+
+    @staticmethod
+    def _tokenize(normalized: str) -> List[str]:
+        return _TOKEN_RE.findall(normalized)
+
+    @staticmethod
+    def _trigrams_of(token: str) -> Set[str]:
+        return {token[i:i + 3] for i in range(len(token) - 2)}
 
     def _ensure_entry(self, agregado_id: str) -> Dict[str, Any]:
         if agregado_id not in self.index:
             self.index[agregado_id] = {
-                "terms": set(),
+                "fields": {},
                 "metadata_loaded": False,
                 "last_updated": time.time(),
             }
+            self._dirty.add(agregado_id)
         return self.index[agregado_id]
 
-    def _add_term(self, entry: Dict[str, Any], text: str) -> bool:
+    def _intern(self, term: str) -> str:
+        term_id = self._term_ids.get(term)
+        if term_id is None:
+            term_id = self._term_ids[term] = len(self._terms)
+            self._terms.append(term)
+        return self._terms[term_id]
+
+    def _index_term(self, agregado_id: str, field: str, normalized: str) -> None:
+        boost = SEARCH_FIELD_BOOSTS.get(field, 1.0)
+        for token in self._tokenize(normalized):
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                for trigram in self._trigrams_of(token):
+                    self._trigrams.setdefault(trigram, set()).add(token)
+            postings[agregado_id] = postings.get(agregado_id, 0.0) + boost
+            self._doc_lengths[agregado_id] = self._doc_lengths.get(agregado_id, 0.0) + boost
+            self._total_length += boost
+
+    def _add_term(self, agregado_id: str, entry: Dict[str, Any], field: str, text: str) -> bool:
         normalized = self._normalize_text(text)
         if not normalized:
             return False
-        terms: Set[str] = entry["terms"]
+        terms: Set[str] = entry["fields"].setdefault(field, set())
         if normalized in terms:
             return False
-        terms.add(normalized)
+        terms.add(self._intern(normalized))
+        self._index_term(agregado_id, field, normalized)
         entry["last_updated"] = time.time()
+        self._dirty.add(agregado_id)
         return True
 
+    @staticmethod
+    def summarize(metadata: Dict[str, Any]) -> Dict[str, Any]:
+        """Resumo compacto dos metadados, suficiente para escolher entre agregados"""
+        periodicidade = metadata.get("periodicidade") or {}
+        niveis = {
+            nivel
+            for lista in (metadata.get("nivelTerritorial") or {}).values()
+            for nivel in (lista or [])
+        }
+        variaveis = metadata.get("variaveis") or []
+        return {
+            "periodicidade": {
+                chave: periodicidade.get(chave) for chave in ("frequencia", "inicio", "fim")
+            },
+            "niveis": sorted(niveis, key=lambda nivel: (len(nivel), nivel)),
+            "variaveis": [
+                {"id": v.get("id"), "nome": v.get("nome"), "unidade": v.get("unidade")}
+                for v in variaveis[:SUMMARY_MAX_VARIAVEIS]
+            ],
+            "total_variaveis": len(variaveis),
+            "classificacoes": [
+                {
+                    "id": c.get("id"),
+                    "nome": c.get("nome"),
+                    "total_categorias": len(c.get("categorias") or []),
+                }
+                for c in metadata.get("classificacoes") or []
+            ],
+        }
+
+    @staticmethod
+    def _needs_metadata(entry: Dict[str, Any]) -> bool:
+        # Entradas enriquecidas antes da existência dos resumos também são refeitas
+        return not entry.get("metadata_loaded") or entry.get("resumo") is None
+
+    def _restore_entries(self, entries: Dict[str, Dict[str, Any]]) -> None:
+        self._attributes = None
+        for agg_id, entry in entries.items():
+            self.index[agg_id] = entry
+            for field, terms in entry["fields"].items():
+                for term in terms:
+                    self._index_term(agg_id, field, term)
+
     def ensure_loaded(self) -> None:
         if self._loaded:
             return
-        if self.cache_path.exists():
-            try:
-                with self.cache_path.open("r", encoding="utf-8") as cache_file:
-                    payload = json.load(cache_file)
-                for agg_id, entry in payload.get("index", {}).items():
-                    terms = set(entry.get("terms", []))
-                    self.index[agg_id] = {
-                        "terms": terms,
-                        "metadata_loaded": entry.get("metadata_loaded", False),
-                        "last_updated": entry.get("last_updated", time.time()),
-                    }
+        try:
+            if self.cache_path.exists():
+                self._restore_entries(self._load_binary())
+            elif self.legacy_json_path.exists():
+                self._restore_entries(self._load_legacy_json())
+                self._dirty.update(self.index)
+                self._needs_rewrite = True
+            if self.index:
                 logger.info(
                     "Índice de agregados carregado do disco (%s entradas)", len(self.index)
                 )
-            except Exception as exc:
-                logger.warning("Falha ao carregar índice local: %s", exc)
+        except Exception as exc:
+            logger.warning("Falha ao carregar índice local: %s", exc)
+            self.index.clear()
+            self._needs_rewrite = True
         self._loaded = True
 
+    def _load_legacy_json(self) -> Dict[str, Dict[str, Any]]:
+        with self.legacy_json_path.open("r", encoding="utf-8") as cache_file:
+            payload = json.load(cache_file)
+        entries: Dict[str, Dict[str, Any]] = {}
+        for agg_id, entry in payload.get("index", {}).items():
+            # Caches antigos guardavam apenas "terms", sem separar por campo
+            fields = {
+                field: {self._intern(term) for term in terms}
+                for field, terms in entry.get(
+                    "fields", {"contexto": entry.get("terms", [])}
+                ).items()
+            }
+            entries[agg_id] = {
+                "fields": fields,
+                "metadata_loaded": entry.get("metadata_loaded", False),
+                "last_updated": entry.get("last_updated", time.time()),
+            }
+        return entries
+
+    def _load_binary(self) -> Dict[str, Dict[str, Any]]:
+        entries: Dict[str, Dict[str, Any]] = {}
+        summaries: Dict[str, Dict[str, Any]] = {}
+        with self.cache_path.open("rb") as cache_file:
+            if os.fstat(cache_file.fileno()).st_size < _INDEX_HEADER.size:
+                self._needs_rewrite = True
+                return entries
+            with mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                magic, version = _INDEX_HEADER.unpack_from(data, 0)
+                if magic != INDEX_FORMAT_MAGIC or version != INDEX_FORMAT_VERSION:
+                    logger.warning(
+                        "Índice local em formato desconhecido (versão %s); será reconstruído", version
+                    )
+                    self._needs_rewrite = True
+                    return entries
+                offset = _INDEX_HEADER.size
+                records = 0
+                while offset + _INDEX_RECORD.size <= len(data):
+                    kind, length = _INDEX_RECORD.unpack_from(data, offset)
+                    start = offset + _INDEX_RECORD.size
+                    if start + length > len(data):
+                        break  # registro truncado por uma gravação interrompida
+                    payload = memoryview(data)[start:start + length]
+                    try:
+                        if kind == b"T":
+                            self._decode_terms(payload)
+                        elif kind == b"E":
+                            agg_id, entry = self._decode_entry(payload)
+                            entries[agg_id] = entry
+                        elif kind == b"S":
+                            agg_id, summary = self._decode_summary(payload)
+                            summaries[agg_id] = summary
+                        # Tipos desconhecidos são ignorados (compatibilidade futura)
+                    finally:
+                        payload.release()
+                    offset = start + length
+                    records += 1
+                if offset != len(data):
+                    self._needs_rewrite = True
+        for agg_id, summary in summaries.items():
+            if agg_id in entries:
+                entries[agg_id]["resumo"] = summary
+        self._persisted_terms = len(self._terms)
+        self._persisted_records = records
+        return entries
+
+    def _decode_terms(self, payload: memoryview) -> None:
+        (count,) = struct.unpack_from("<I", payload, 0)
+        offset = 4
+        for _ in range(count):
+            (length,) = _INDEX_ENTRY_HEAD.unpack_from(payload, offset)
+            offset += _INDEX_ENTRY_HEAD.size
+            self._intern(bytes(payload[offset:offset + length]).decode("utf-8"))
+            offset += length
+
+    def _decode_entry(self, payload: memoryview) -> Tuple[str, Dict[str, Any]]:
+        (id_length,) = _INDEX_ENTRY_HEAD.unpack_from(payload, 0)
+        offset = _INDEX_ENTRY_HEAD.size
+        agg_id = bytes(payload[offset:offset + id_length]).decode("utf-8")
+        offset += id_length
+        flags, last_updated, field_count = _INDEX_ENTRY_META.unpack_from(payload, offset)
+        offset += _INDEX_ENTRY_META.size
+        fields: Dict[str, Set[str]] = {}
+        for _ in range(field_count):
+            code, count = _INDEX_FIELD_HEAD.unpack_from(payload, offset)
+            offset += _INDEX_FIELD_HEAD.size
+            term_ids = array("I")
+            term_ids.frombytes(payload[offset:offset + 4 * count])
+            offset += 4 * count
+            fields[INDEX_FIELD_CODES[code]] = {self._terms[term_id] for term_id in term_ids}
+        return agg_id, {
+            "fields": fields,
+            "metadata_loaded": bool(flags & 1),
+            "last_updated": last_updated,
+        }
+
+    @staticmethod
+    def _decode_summary(payload: memoryview) -> Tuple[str, Dict[str, Any]]:
+        (id_length,) = _INDEX_ENTRY_HEAD.unpack_from(payload, 0)
+        offset = _INDEX_ENTRY_HEAD.size
+        agg_id = bytes(payload[offset:offset + id_length]).decode("utf-8")
+        return agg_id, json_codec.loads(bytes(payload[offset + id_length:]))
+
+    @staticmethod
+    def _encode_record(kind: bytes, payload: bytes) -> bytes:
+        return _INDEX_RECORD.pack(kind, len(payload)) + payload
+
+    def _encode_terms(self, start: int) -> bytes:
+        parts = [struct.pack("<I", len(self._terms) - start)]
+        for term in self._terms[start:]:
+            encoded = term.encode("utf-8")
+            parts.append(_INDEX_ENTRY_HEAD.pack(len(encoded)))
+            parts.append(encoded)
+        return self._encode_record(b"T", b"".join(parts))
+
+    def _encode_entry(self, agg_id: str, entry: Dict[str, Any]) -> bytes:
+        encoded_id = agg_id.encode("utf-8")
+        fields = [(field, terms) for field, terms in entry["fields"].items() if terms]
+        parts = [
+            _INDEX_ENTRY_HEAD.pack(len(encoded_id)),
+            encoded_id,
+            _INDEX_ENTRY_META.pack(
+                1 if entry.get("metadata_loaded") else 0,
+                entry.get("last_updated", time.time()),
+                len(fields),
+            ),
+        ]
+        for field, terms in fields:
+            term_ids = array("I", sorted(self._term_ids[term] for term in terms))
+            parts.append(_INDEX_FIELD_HEAD.pack(INDEX_FIELD_CODES.index(field), len(term_ids)))
+            parts.append(term_ids.tobytes())
+        return self._encode_record(b"E", b"".join(parts))
+
+    def _encode_entry_records(self, agg_id: str, entry: Dict[str, Any]) -> List[bytes]:
+        records = [self._encode_entry(agg_id, entry)]
+        if entry.get("resumo") is not None:
+            encoded_id = agg_id.encode("utf-8")
+            records.append(self._encode_record(
+                b"S",
+                _INDEX_ENTRY_HEAD.pack(len(encoded_id)) + encoded_id + json_codec.dumps(entry["resumo"]),
+            ))
+        return records
+
     def save(self) -> None:
+        """Anexa termos novos e entradas alteradas; compacta o arquivo quando necessário"""
         try:
-            serializable_index = {
-                agg_id: {
-                    "terms": sorted(entry["terms"]),
-                    "metadata_loaded": entry.get("metadata_loaded", False),
-                    "last_updated": entry.get("last_updated", time.time()),
-                }
-                for agg_id, entry in self.index.items()
-            }
-            with self.cache_path.open("w", encoding="utf-8") as cache_file:
-                json.dump({"index": serializable_index}, cache_file, ensure_ascii=False, indent=2)
+            live_records = 2 * len(self.index) + 1
+            rewrite = (
+                self._needs_rewrite
+                or not self.cache_path.exists()
+                or self._persisted_records + len(self._dirty) > 2 * live_records + 64
+            )
+            if rewrite:
+                records = [self._encode_terms(0)]
+                for agg_id, entry in self.index.items():
+                    records.extend(self._encode_entry_records(agg_id, entry))
+                tmp_path = self.cache_path.with_suffix(".tmp")
+                with tmp_path.open("wb") as cache_file:
+                    cache_file.write(_INDEX_HEADER.pack(INDEX_FORMAT_MAGIC, INDEX_FORMAT_VERSION))
+                    cache_file.write(b"".join(records))
+                os.replace(tmp_path, self.cache_path)
+                self._persisted_records = len(records)
+                self._needs_rewrite = False
+            else:
+                if not self._dirty and self._persisted_terms == len(self._terms):
+                    return
+                records = []
+                if self._persisted_terms < len(self._terms):
+                    records.append(self._encode_terms(self._persisted_terms))
+                for agg_id in self._dirty:
+                    if agg_id in self.index:
+                        records.extend(self._encode_entry_records(agg_id, self.index[agg_id]))
+                with self.cache_path.open("ab") as cache_file:
+                    cache_file.write(b"".join(records))
+                self._persisted_records += len(records)
+            self._persisted_terms = len(self._terms)
+            self._dirty.clear()
         except Exception as exc:
             logger.warning("Não foi possível salvar o índice local: %s", exc)
 
     def build_basic_index(self, pesquisas: List[Dict[str, Any]]) -> bool:
         self.ensure_loaded()
+        if pesquisas is self._indexed_catalog:
+            return False
         changed = False
+        catalog_info: Dict[str, Tuple[int, Dict[str, Any]]] = {}
         for pesquisa in pesquisas:
             pesquisa_nome = pesquisa.get("nome", "")
             for agregado in pesquisa.get("agregados", []):
                 agregado_id = str(agregado.get("id"))
+                catalog_info[agregado_id] = (
+                    len(catalog_info),
+                    {
+                        "agregado_id": agregado.get("id"),
+                        "agregado_nome": agregado.get("nome", ""),
+                        "pesquisa": pesquisa_nome,
+                        "pesquisa_id": pesquisa.get("id"),
+                    },
+                )
                 entry = self._ensure_entry(agregado_id)
-                if self._add_term(entry, pesquisa_nome):
+                if self._add_term(agregado_id, entry, "pesquisa", pesquisa_nome):
                     changed = True
-                if self._add_term(entry, agregado.get("nome", "")):
+                if self._add_term(agregado_id, entry, "agregado", agregado.get("nome", "")):
                     changed = True
-                if self._add_term(entry, agregado.get("descricao", "")):
+                if self._add_term(agregado_id, entry, "agregado", agregado.get("descricao", "")):
                     changed = True
+        self._catalog_info = catalog_info
+        self._indexed_catalog = pesquisas
         return changed
 
-    def enrich_with_metadados(self, agregado_id: str) -> bool:
+    async def enrich_with_metadados(self, agregado_id: str) -> bool:
         entry = self._ensure_entry(agregado_id)
-        if entry.get("metadata_loaded"):
+        if not self._needs_metadata(entry):
             return False
 
-        metadata = self.client.get_agregado_metadados(int(agregado_id))
+        metadata = await self.client.get_agregado_metadados_async(int(agregado_id))
         changed = False
-        for field in ("nome", "pesquisa", "assunto"):
-            if self._add_term(entry, metadata.get(field, "")):
+        for field, index_field in (("nome", "agregado"), ("pesquisa", "pesquisa"), ("assunto", "contexto")):
+            if self._add_term(agregado_id, entry, index_field, metadata.get(field, "")):
                 changed = True
         periodicidade = metadata.get("periodicidade", {})
         for periodo_field in ("frequencia",):
-            if self._add_term(entry, periodicidade.get(periodo_field, "")):
+            if self._add_term(agregado_id, entry, "contexto", periodicidade.get(periodo_field, "")):
                 changed = True
 
         for variavel in metadata.get("variaveis", []):
-            if self._add_term(entry, variavel.get("nome", "")):
+            if self._add_term(agregado_id, entry, "variavel", variavel.get("nome", "")):
                 changed = True
 
         for classificacao in metadata.get("classificacoes", []):
-            if self._add_term(entry, classificacao.get("nome", "")):
+            if self._add_term(agregado_id, entry, "classificacao", classificacao.get("nome", "")):
                 changed = True
             for categoria in classificacao.get("categorias", []):
-                if self._add_term(entry, categoria.get("nome", "")):
+                if self._add_term(agregado_id, entry, "categoria", categoria.get("nome", "")):
                     changed = True
 
+        entry["resumo"] = self.summarize(metadata)
+        self._attributes = None
         entry["metadata_loaded"] = True
         entry["last_updated"] = time.time()
+        self._dirty.add(agregado_id)
         return True
 
-    def _term_matches(self, entry: Dict[str, Any], normalized_term: str) -> bool:
-        if not normalized_term:
-            return False
-        return any(normalized_term in term for term in entry.get("terms", set()))
+    def _vocabulary_matches(self, query_token: str) -> Set[str]:
+        """Tokens do vocabulário que contêm ``query_token`` como substring"""
+        if len(query_token) < 3:
+            # Consultas curtas não têm trigramas: varre apenas o vocabulário
+            candidates: Any = self._postings.keys()
+        else:
+            trigram_sets = [self._trigrams.get(t, set()) for t in self._trigrams_of(query_token)]
+            trigram_sets.sort(key=len)
+            candidates = set(trigram_sets[0])
+            for trigram_set in trigram_sets[1:]:
+                candidates &= trigram_set
+                if not candidates:
+                    break
+        return {token for token in candidates if query_token in token}
+
+    def _score(self, normalized_term: str) -> Dict[str, float]:
+        """Pontuação BM25F dos agregados que contêm todos os tokens da consulta"""
+        total_docs = len(self.index) or 1
+        avg_length = self._total_length / total_docs or 1.0
+        scores: Optional[Dict[str, float]] = None
+        for query_token in sorted(set(self._tokenize(normalized_term)), key=len, reverse=True):
+            weighted_tf: Dict[str, float] = {}
+            for token in self._vocabulary_matches(query_token):
+                weight = 1.0 if token == query_token else PARTIAL_MATCH_WEIGHT
+                for agregado_id, tf in self._postings[token].items():
+                    weighted_tf[agregado_id] = weighted_tf.get(agregado_id, 0.0) + tf * weight
+            doc_freq = len(weighted_tf)
+            if scores is not None:
+                weighted_tf = {k: v for k, v in weighted_tf.items() if k in scores}
+            if not weighted_tf:
+                return {}
+            idf = math.log(1 + (total_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+            token_scores: Dict[str, float] = {}
+            for agregado_id, tf in weighted_tf.items():
+                length_norm = 1 - BM25_B + BM25_B * self._doc_lengths.get(agregado_id, 0.0) / avg_length
+                token_scores[agregado_id] = idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * length_norm)
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {k: scores[k] + v for k, v in token_scores.items()}
+        return scores or {}
+
+    def _attribute_index(self) -> Dict[str, Any]:
+        if self._attributes is None:
+            niveis: Dict[str, Set[str]] = {}
+            periodicidades: Dict[str, Set[str]] = {}
+            intervals: List[Tuple[int, int, str]] = []
+            for agregado_id, entry in self.index.items():
+                resumo = entry.get("resumo")
+                if resumo is None:
+                    continue
+                for nivel in resumo.get("niveis", []):
+                    niveis.setdefault(nivel.upper(), set()).add(agregado_id)
+                periodicidade = resumo.get("periodicidade") or {}
+                frequencia = self._normalize_text(periodicidade.get("frequencia") or "")
+                if frequencia:
+                    periodicidades.setdefault(frequencia, set()).add(agregado_id)
+                inicio = period_year(periodicidade.get("inicio"))
+                fim = period_year(periodicidade.get("fim"))
+                if inicio is not None:
+                    intervals.append((inicio, fim if fim is not None else inicio, agregado_id))
+            self._attributes = {
+                "niveis": niveis,
+                "periodicidades": periodicidades,
+                "periodos": PeriodIntervalTree(intervals),
+            }
+        return self._attributes
+
+    def filter_ids(
+        self,
+        nivel: Optional[str] = None,
+        periodicidade: Optional[str] = None,
+        periodo_desde: Optional[int] = None,
+        periodo_ate: Optional[int] = None,
+    ) -> Optional[Set[str]]:
+        """Agregados (já enriquecidos) que atendem aos filtros; None se não há filtros.
+
+        ``nivel`` aceita vários níveis separados por "|" ou "," (basta um
+        deles); os períodos são comparados por ano e o agregado precisa ter
+        dados em algum ano da faixa.
+        """
+        if not (nivel or periodicidade or periodo_desde is not None or periodo_ate is not None):
+            return None
+        self.ensure_loaded()
+        attributes = self._attribute_index()
+        candidates: Optional[Set[str]] = None
+
+        def restrict(ids: Set[str]) -> None:
+            nonlocal candidates
+            candidates = set(ids) if candidates is None else candidates & ids
+
+        if nivel:
+            ids: Set[str] = set()
+            for item in re.split(r"[|,]", nivel):
+                ids |= attributes["niveis"].get(item.strip().upper(), set())
+            restrict(ids)
+        if periodicidade:
+            restrict(attributes["periodicidades"].get(self._normalize_text(periodicidade), set()))
+        if periodo_desde is not None or periodo_ate is not None:
+            start = period_year(periodo_desde) if periodo_desde is not None else float("-inf")
+            end = period_year(periodo_ate) if periodo_ate is not None else float("inf")
+            restrict(attributes["periodos"].overlapping(start, end))
+        return candidates or set()
 
     def pending_metadata_count(self) -> int:
-        return sum(1 for entry in self.index.values() if not entry.get("metadata_loaded"))
+        return sum(1 for entry in self.index.values() if self._needs_metadata(entry))
+
+    def pending_ids(self) -> List[str]:
+        """Agregados do catálogo atual ainda sem metadados, na ordem do catálogo"""
+        return [
+            agregado_id
+            for agregado_id in self._catalog_info
+            if self._needs_metadata(self.index[agregado_id])
+        ]
 
     def search(
         self,
         termo: str,
         pesquisas: List[Dict[str, Any]],
         limite: int,
+        candidatos: Optional[Set[str]] = None,
     ) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
-        self.ensure_loaded()
-        dirty = self.build_basic_index(pesquisas)
-
-        normalized_term = self._normalize_text(termo)
-        matches: List[Tuple[int, int, Dict[str, Any]]] = []
-        metadata_fetches = 0
-        metadata_errors = 0
-        ordem = 0
-
-        for pesquisa in pesquisas:
-            pesquisa_nome = pesquisa.get("nome", "")
-            for agregado in pesquisa.get("agregados", []):
-                agregado_id = str(agregado.get("id"))
-                entry = self._ensure_entry(agregado_id)
-
-                if self._term_matches(entry, normalized_term):
-                    score = 0 if entry.get("metadata_loaded") else 1
-                    matches.append(
-                        (
-                            score,
-                            ordem,
-                            {
-                                "agregado_id": agregado.get("id"),
-                                "agregado_nome": agregado.get("nome", ""),
-                                "pesquisa": pesquisa_nome,
-                                "pesquisa_id": pesquisa.get("id"),
-                            },
-                        )
-                    )
-                    ordem += 1
-                    continue
+        """Consulta apenas o índice local; o enriquecimento fica com o MetadataPrefetcher.
 
-                if (
-                    normalized_term
-                    and not entry.get("metadata_loaded")
-                    and metadata_fetches < self.max_metadata_per_search
-                ):
-                    try:
-                        if self.enrich_with_metadados(agregado_id):
-                            dirty = True
-                        metadata_fetches += 1
-                    except Exception as exc:
-                        metadata_errors += 1
-                        logger.warning(
-                            "Falha ao enriquecer índice para agregado %s: %s",
-                            agregado_id,
-                            exc,
-                        )
-                    else:
-                        entry = self._ensure_entry(agregado_id)
-                        if self._term_matches(entry, normalized_term):
-                            matches.append(
-                                (
-                                    0,
-                                    ordem,
-                                    {
-                                        "agregado_id": agregado.get("id"),
-                                        "agregado_nome": agregado.get("nome", ""),
-                                        "pesquisa": pesquisa_nome,
-                                        "pesquisa_id": pesquisa.get("id"),
-                                    },
-                                )
-                            )
-                            ordem += 1
-
-        if dirty:
+        ``candidatos`` (de ``filter_ids``) restringe os resultados; sem termo,
+        os candidatos são devolvidos na ordem do catálogo.
+        """
+        self.ensure_loaded()
+        if self.build_basic_index(pesquisas):
             self.save()
 
-        matches.sort(key=lambda item: (item[0], item[1]))
-        resultados = [item[2] for item in matches[:limite]]
+        normalized = self._normalize_text(termo)
+        if normalized:
+            scores = self._score(normalized)
+            if candidatos is not None:
+                scores = {k: v for k, v in scores.items() if k in candidatos}
+        else:
+            scores = dict.fromkeys(candidatos or (), 0.0)
+        matches: List[Tuple[float, int, Dict[str, Any]]] = []
+        for agregado_id, score in scores.items():
+            info = self._catalog_info.get(agregado_id)
+            if info is None:
+                # Agregado presente no índice em disco, mas fora do catálogo atual
+                continue
+            matches.append((score, info[0], info[1]))
+
+        matches.sort(key=lambda item: (-item[0], item[1]))
+        resultados = []
+        for score, _, info in matches[:limite]:
+            resultado = {**info, "score": round(score, 4)}
+            resumo = self.index[str(info["agregado_id"])].get("resumo")
+            if resumo is not None:
+                resultado["resumo"] = resumo
+            resultados.append(resultado)
 
         stats = {
-            "metadata_fetches": metadata_fetches,
-            "metadata_errors": metadata_errors,
             "pendencias_indice": self.pending_metadata_count(),
         }
         return resultados, stats
 
+
+class MetadataPrefetcher:
+    """Enriquece o índice de agregados com metadados em segundo plano.
+
+    Percorre os agregados pendentes com concorrência limitada e ritmo máximo
+    de requisições, gravando o índice em disco a cada ``checkpoint_every``
+    agregados para não perder progresso se o servidor for reiniciado.
+    """
+
+    def __init__(
+        self,
+        index: AgregadoSearchIndex,
+        concurrency: int = PREFETCH_CONCURRENCY,
+        rate_per_second: float = PREFETCH_RATE,
+        checkpoint_every: int = PREFETCH_CHECKPOINT,
+        retry_failed_after: float = 600.0,
+    ):
+        self.index = index
+        self.concurrency = concurrency
+        self.rate_per_second = rate_per_second
+        self.checkpoint_every = max(1, checkpoint_every)
+        self.retry_failed_after = retry_failed_after
+        self._task: Optional[asyncio.Task] = None
+        self._next_slot = 0.0
+        self._failed: Dict[str, float] = {}
+        self._since_checkpoint = 0
+        self.completed = 0
+        self.errors = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> bool:
+        """Inicia uma rodada de enriquecimento se houver pendências; não bloqueia"""
+        if self.concurrency <= 0 or self.running:
+            return False
+        now = time.monotonic()
+        pending = [
+            agregado_id
+            for agregado_id in self.index.pending_ids()
+            if now - self._failed.get(agregado_id, float("-inf")) >= self.retry_failed_after
+        ]
+        if not pending:
+            return False
+        self._task = asyncio.get_running_loop().create_task(self._run(pending))
+        return True
+
+    async def _throttle(self) -> None:
+        if self.rate_per_second <= 0:
+            return
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + 1.0 / self.rate_per_second
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _worker(self, pending: Any) -> None:
+        for agregado_id in pending:
+            await self._throttle()
+            try:
+                await self.index.enrich_with_metadados(agregado_id)
+            except Exception as exc:
+                self.errors += 1
+                self._failed[agregado_id] = time.monotonic()
+                logger.warning(
+                    "Falha ao enriquecer índice para agregado %s: %s", agregado_id, exc
+                )
+                continue
+            self._failed.pop(agregado_id, None)
+            self.completed += 1
+            self._since_checkpoint += 1
+            if self._since_checkpoint >= self.checkpoint_every:
+                self.index.save()
+                self._since_checkpoint = 0
+
+    async def _run(self, pending: List[str]) -> None:
+        # As chamadas de ferramentas têm precedência no limitador de taxa do cliente
+        request_priority.set(PRIORITY_BACKGROUND)
+        logger.info("Enriquecimento do índice iniciado (%s agregados pendentes)", len(pending))
+        # Um único iterador compartilhado distribui os agregados entre os workers
+        shared = iter(pending)
+        try:
+            await asyncio.gather(
+                *(self._worker(shared) for _ in range(min(self.concurrency, len(pending))))
+            )
+        finally:
+            if self._since_checkpoint:
+                self.index.save()
+                self._since_checkpoint = 0
+            logger.info(
+                "Enriquecimento do índice finalizado (%s pendentes)",
+                self.index.pending_metadata_count(),
+            )
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "em_execucao": self.running,
+            "pendencias_metadados": self.index.pending_metadata_count(),
+            "metadados_carregados": self.completed,
+            "erros": self.errors,
+        }
+
+class LocalidadeGazetteer:
+    """Índice local de nomes de localidades, um por nível geográfico.
+
+    Os IDs de localidades são globais no IBGE, então o índice de nomes de
+    cada nível é compartilhado entre os agregados e cresce com as localidades
+    de cada agregado consultado. Como cada agregado cobre um conjunto
+    diferente de localidades, as buscas são restritas aos IDs do próprio
+    agregado (lista obtida com cache por ``get_localidades_async``). Os nomes
+    já ficam normalizados e indexados para busca exata, por prefixo de
+    palavras e aproximada (distância de edição, com candidatos pré-filtrados
+    por trigramas).
+    """
+
+    def __init__(self, client: IBGEAPIClient, max_fuzzy_candidates: int = 50):
+        self.client = client
+        self.max_fuzzy_candidates = max_fuzzy_candidates
+        self._niveis: Dict[str, Dict[str, Any]] = {}
+        self._ids_agregado: Dict[Tuple[int, str], Set[str]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    @staticmethod
+    def _base_name(normalized: str) -> str:
+        # "sao paulo - sp" -> "sao paulo"
+        return normalized.rsplit(" - ", 1)[0]
+
+    def _build(self, localidades: List[Dict[str, Any]]) -> Dict[str, Any]:
+        indice: Dict[str, Any] = {
+            "localidades": [],
+            "ids": set(),
+            "nomes": [],
+            "exatos": {},
+            "tokens": {},
+            "vocabulario": [],
+            "trigramas": {},
+        }
+        self._extend(indice, localidades)
+        return indice
+
+    def _extend(self, indice: Dict[str, Any], localidades: List[Dict[str, Any]]) -> int:
+        """Acrescenta ao índice as localidades que ainda não estão nele"""
+        novas = 0
+        for localidade in localidades:
+            loc_id = str(localidade.get("id"))
+            if loc_id in indice["ids"]:
+                continue
+            i = len(indice["localidades"])
+            indice["localidades"].append(localidade)
+            indice["ids"].add(loc_id)
+            nome = normalize_text(localidade.get("nome", ""))
+            base = self._base_name(nome)
+            indice["nomes"].append(base)
+            for chave in {nome, base}:
+                indice["exatos"].setdefault(chave, []).append(i)
+            for token in _TOKEN_RE.findall(nome):
+                indice["tokens"].setdefault(token, set()).add(i)
+            for trigrama in self._trigrams_of(base):
+                indice["trigramas"].setdefault(trigrama, set()).add(i)
+            novas += 1
+        if novas:
+            indice["vocabulario"] = sorted(indice["tokens"])
+        return novas
+
+    @staticmethod
+    def _trigrams_of(texto: str) -> Set[str]:
+        texto = f"  {texto} "
+        return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+    async def ensure_nivel(self, agregado_id: int, nivel: str) -> Tuple[Dict[str, Any], Set[str]]:
+        """Índice de nomes do nível e os IDs de localidades do agregado nesse nível"""
+        chave = (agregado_id, nivel)
+        ids = self._ids_agregado.get(chave)
+        if ids is not None:
+            return self._niveis[nivel], ids
+        lock = self._locks.setdefault(nivel, asyncio.Lock())
+        async with lock:
+            ids = self._ids_agregado.get(chave)
+            if ids is None:
+                localidades = await self.client.get_localidades_async(agregado_id, nivel)
+                indice = self._niveis.get(nivel)
+                if indice is None:
+                    indice = self._niveis[nivel] = self._build(localidades)
+                    logger.info("Gazetteer do nível %s carregado (%s localidades)", nivel, len(localidades))
+                elif self._extend(indice, localidades):
+                    logger.info("Gazetteer do nível %s ampliado (%s localidades)", nivel, len(indice["ids"]))
+                ids = self._ids_agregado[chave] = {str(loc.get("id")) for loc in localidades}
+        return self._niveis[nivel], ids
+
+    @staticmethod
+    def _edit_distance(a: str, b: str, limite: int) -> int:
+        if abs(len(a) - len(b)) > limite:
+            return limite + 1
+        anterior = list(range(len(b) + 1))
+        for i, char_a in enumerate(a, 1):
+            atual = [i] + [0] * len(b)
+            for j, char_b in enumerate(b, 1):
+                atual[j] = min(
+                    anterior[j] + 1,
+                    atual[j - 1] + 1,
+                    anterior[j - 1] + (char_a != char_b),
+                )
+            if min(atual) > limite:
+                return limite + 1
+            anterior = atual
+        return anterior[-1]
+
+    def _prefix_ids(self, indice: Dict[str, Any], token: str) -> Set[int]:
+        vocabulario: List[str] = indice["vocabulario"]
+        ids: Set[int] = set()
+        pos = bisect.bisect_left(vocabulario, token)
+        while pos < len(vocabulario) and vocabulario[pos].startswith(token):
+            ids |= indice["tokens"][vocabulario[pos]]
+            pos += 1
+        return ids
+
+    def lookup(self, indice: Dict[str, Any], nome: str,
+               permitidos: Optional[Set[str]] = None) -> Tuple[List[Dict[str, Any]], str]:
+        """Retorna (localidades, tipo de correspondência) para um nome.
+
+        Correspondências exatas vêm primeiro, seguidas das demais por prefixo
+        de palavras ("sao jose" traz "São José" e também "São José dos Campos"),
+        para que nomes ambíguos continuem visíveis. ``permitidos`` restringe o
+        resultado aos IDs de localidades de um agregado.
+        """
+        consulta = normalize_text(nome)
+        if not consulta:
+            return [], "nenhuma"
+        localidades = indice["localidades"]
+
+        def permitido(i: int) -> bool:
+            return permitidos is None or str(localidades[i].get("id")) in permitidos
+
+        exatos = [i for i in indice["exatos"].get(consulta, []) if permitido(i)]
+        tokens = _TOKEN_RE.findall(consulta)
+        if tokens:
+            candidatos: Optional[Set[int]] = None
+            for token in tokens:
+                ids = self._prefix_ids(indice, token)
+                candidatos = ids if candidatos is None else candidatos & ids
+                if not candidatos:
+                    break
+            candidatos = {i for i in (candidatos or ()) if permitido(i)}.difference(exatos)
+            if exatos or candidatos:
+                # Nomes que começam pela consulta primeiro, depois os demais
+                ordenados = sorted(
+                    candidatos,
+                    key=lambda i: (not indice["nomes"][i].startswith(consulta), indice["nomes"][i]),
+                )
+                return (
+                    [localidades[i] for i in exatos] + [localidades[i] for i in ordenados],
+                    "exata" if exatos else "prefixo",
+                )
+        elif exatos:
+            return [localidades[i] for i in exatos], "exata"
+
+        contagem: Dict[int, int] = {}
+        for trigrama in self._trigrams_of(consulta):
+            for i in indice["trigramas"].get(trigrama, ()):
+                if permitido(i):
+                    contagem[i] = contagem.get(i, 0) + 1
+        melhores = sorted(contagem, key=contagem.get, reverse=True)[:self.max_fuzzy_candidates]
+        limite = max(1, len(consulta) // 4)
+        aproximados = []
+        for i in melhores:
+            distancia = self._edit_distance(consulta, indice["nomes"][i], limite)
+            if distancia <= limite:
+                aproximados.append((distancia, i))
+        aproximados.sort()
+        return [localidades[i] for _, i in aproximados], "aproximada"
+
+
 # Inicializar servidor MCP e infraestrutura auxiliar
 mcp = FastMCP(name="IBGE-Data-Server")
 ibge_client = IBGEAPIClient()
+catalog_store = CatalogStore(ibge_client)
 search_index = AgregadoSearchIndex(ibge_client)
+metadata_prefetcher = MetadataPrefetcher(search_index)
+gazetteer = LocalidadeGazetteer(ibge_client)
 
 @mcp.tool()
-def listar_agregados(periodo: Optional[str] = None, 
+async def listar_agregados(periodo: Optional[str] = None, 
                     assunto: Optional[int] = None,
                     classificacao: Optional[int] = None,
                     periodicidade: Optional[str] = None,
@@ -377,7 +3397,7 @@ def listar_agregados(periodo: Optional[str] = None,
         if nivel:
             filters['nivel'] = nivel
             
-        resultado = ibge_client.get_agregados(**filters)
+        resultado = await catalog_store.get(**filters)
         
         return {
             "status": "sucesso",
@@ -389,40 +3409,188 @@ def listar_agregados(periodo: Optional[str] = None,
     except Exception as e:
         return {"status": "erro", "mensagem": str(e)}
 
+def _resumo_metadados(agregado_id: int, metadados: Dict[str, Any]) -> Dict[str, Any]:
+    """Forma compacta dos metadados: variáveis sem extras e classificações sem categorias"""
+    return {
+        "agregado_id": agregado_id,
+        "nome": metadados.get("nome", ""),
+        "pesquisa": metadados.get("pesquisa", ""),
+        "assunto": metadados.get("assunto", ""),
+        "periodicidade": metadados.get("periodicidade", {}),
+        "nivel_territorial": metadados.get("nivelTerritorial", {}),
+        "variaveis": [
+            {"id": v.get("id"), "nome": v.get("nome"), "unidade": v.get("unidade")}
+            for v in metadados.get("variaveis", [])
+        ],
+        "classificacoes": [
+            {"id": c.get("id"), "nome": c.get("nome"), "total_categorias": len(c.get("categorias") or [])}
+            for c in metadados.get("classificacoes", [])
+        ],
+    }
+
+
+# Campos de obter_metadados_agregado e a chave correspondente nos metadados da API
+CAMPOS_METADADOS = {
+    "nome": ("nome", ""),
+    "pesquisa": ("pesquisa", ""),
+    "assunto": ("assunto", ""),
+    "periodicidade": ("periodicidade", {}),
+    "nivel_territorial": ("nivelTerritorial", {}),
+    "variaveis": ("variaveis", []),
+    "classificacoes": ("classificacoes", []),
+    "url_sidra": ("URL", ""),
+}
+
+
+def _projetar_classificacoes(classificacoes: List[Dict[str, Any]],
+                             categorias_de: Optional[Set[str]],
+                             max_categorias: Optional[int]) -> List[Dict[str, Any]]:
+    """Recorta as categorias de cada classificação sem alterar os metadados em cache"""
+    projetadas = []
+    for classificacao in classificacoes:
+        categorias = classificacao.get("categorias") or []
+        item = {k: v for k, v in classificacao.items() if k != "categorias"}
+        item["total_categorias"] = len(categorias)
+        if categorias_de is None or str(classificacao.get("id")) in categorias_de:
+            if max_categorias is not None and len(categorias) > max_categorias:
+                item["categorias"] = categorias[:max_categorias]
+                item["categorias_truncadas"] = True
+            else:
+                item["categorias"] = categorias
+        projetadas.append(item)
+    return projetadas
+
+
 @mcp.tool()
-def obter_metadados_agregado(agregado_id: int) -> Dict[str, Any]:
+async def obter_metadados_agregado(agregado_id: int,
+                                   campos: Optional[str] = None,
+                                   categorias_de: Optional[str] = None,
+                                   max_categorias: Optional[int] = None,
+                                   resumo: bool = False) -> Dict[str, Any]:
     """
     Obtém metadados completos de um agregado específico.
+    Tabelas do Censo podem ter milhares de categorias: use os parâmetros
+    abaixo para trazer apenas o necessário.
     
     Args:
         agregado_id: ID do agregado (ex: 1705, 1712)
+        campos: Campos desejados, separados por vírgula, entre nome, pesquisa,
+                assunto, periodicidade, nivel_territorial, variaveis,
+                classificacoes e url_sidra (padrão: todos)
+        categorias_de: IDs das classificações cujas categorias devem ser
+                       incluídas (ex: "2,226"); "nenhuma" omite todas.
+                       Padrão: categorias de todas as classificações
+        max_categorias: Máximo de categorias por classificação
+        resumo: Se True, devolve apenas o resumo (variáveis e classificações
+                com o total de categorias), ignorando os demais parâmetros
     
     Returns:
         Metadados do agregado incluindo variáveis, classificações e períodos
     """
     try:
-        metadados = ibge_client.get_agregado_metadados(agregado_id)
+        if campos:
+            selecionados = [c.strip() for c in campos.split(",") if c.strip()]
+            invalidos = [c for c in selecionados if c not in CAMPOS_METADADOS]
+            if invalidos:
+                return {
+                    "status": "erro",
+                    "mensagem": f"Campos inválidos: {', '.join(invalidos)}. "
+                                f"Use: {', '.join(CAMPOS_METADADOS)}",
+                }
+        else:
+            selecionados = list(CAMPOS_METADADOS)
+        if max_categorias is not None and max_categorias < 0:
+            return {"status": "erro", "mensagem": "max_categorias deve ser maior ou igual a zero"}
+
+        metadados = await ibge_client.get_agregado_metadados_async(agregado_id)
 
         if not metadados:
             return {"status": "erro", "mensagem": f"Agregado {agregado_id} não encontrado"}
-        
-        return {
-            "status": "sucesso",
-            "agregado_id": agregado_id,
-            "nome": metadados.get("nome", ""),
-            "pesquisa": metadados.get("pesquisa", ""),
-            "assunto": metadados.get("assunto", ""),
-            "periodicidade": metadados.get("periodicidade", {}),
-            "nivel_territorial": metadados.get("nivelTerritorial", {}),
-            "variaveis": metadados.get("variaveis", []),
-            "classificacoes": metadados.get("classificacoes", []),
-            "url_sidra": metadados.get("URL", "")
+
+        if resumo:
+            return {"status": "sucesso", **_resumo_metadados(agregado_id, metadados)}
+
+        resultado: Dict[str, Any] = {"status": "sucesso", "agregado_id": agregado_id}
+        for campo in selecionados:
+            chave, padrao = CAMPOS_METADADOS[campo]
+            resultado[campo] = metadados.get(chave, padrao)
+
+        if "classificacoes" in resultado and (categorias_de is not None or max_categorias is not None):
+            filtro = None
+            if categorias_de is not None:
+                filtro = set() if categorias_de.strip().lower() == "nenhuma" else {
+                    c.strip() for c in re.split(r"[,|]", categorias_de) if c.strip()
+                }
+            resultado["classificacoes"] = _projetar_classificacoes(
+                resultado["classificacoes"], filtro, max_categorias
+            )
+        return resultado
+    except Exception as e:
+        return {"status": "erro", "mensagem": str(e)}
+
+@mcp.tool()
+async def obter_metadados_agregados(agregado_ids: str) -> Dict[str, Any]:
+    """
+    Obtém, em uma única chamada, metadados resumidos de vários agregados.
+    Ideal para comparar tabelas candidatas antes de consultar dados.
+    
+    Args:
+        agregado_ids: IDs separados por vírgula (ex: "1705,1712,5938"), até 50
+    
+    Returns:
+        Para cada agregado: nome, pesquisa, periodicidade, níveis territoriais,
+        variáveis e classificações (com o total de categorias); falhas são
+        listadas em "erros" sem impedir os demais
+    """
+    try:
+        ids: List[int] = []
+        for parte in re.split(r"[,|;\s]+", str(agregado_ids).strip("[] ")):
+            if not parte:
+                continue
+            try:
+                agregado_id = int(parte)
+            except ValueError:
+                return {"status": "erro", "mensagem": f"ID de agregado inválido: '{parte}'"}
+            if agregado_id not in ids:
+                ids.append(agregado_id)
+        if not ids:
+            return {"status": "erro", "mensagem": "Informe ao menos um ID de agregado"}
+        if len(ids) > MAX_METADADOS_POR_LOTE:
+            return {
+                "status": "erro",
+                "mensagem": f"Máximo de {MAX_METADADOS_POR_LOTE} agregados por chamada ({len(ids)} informados)",
+            }
+
+        # Cache, agrupamento de requisições idênticas e limites de taxa ficam no cliente
+        respostas = await asyncio.gather(
+            *(ibge_client.get_agregado_metadados_async(agregado_id) for agregado_id in ids),
+            return_exceptions=True,
+        )
+        agregados = []
+        erros = []
+        for agregado_id, resposta in zip(ids, respostas):
+            if isinstance(resposta, Exception):
+                erros.append({"agregado_id": agregado_id, "mensagem": str(resposta)})
+            elif not resposta:
+                erros.append({"agregado_id": agregado_id, "mensagem": f"Agregado {agregado_id} não encontrado"})
+            else:
+                agregados.append(_resumo_metadados(agregado_id, resposta))
+
+        resultado: Dict[str, Any] = {
+            "status": "sucesso" if agregados else "erro",
+            "total_solicitados": len(ids),
+            "total_encontrados": len(agregados),
+            "agregados": agregados,
+            "erros": erros,
         }
+        if not agregados:
+            resultado["mensagem"] = "Nenhum dos agregados informados pôde ser obtido"
+        return resultado
     except Exception as e:
         return {"status": "erro", "mensagem": str(e)}
 
 @mcp.tool()
-def obter_localidades(agregado_id: int, nivel: str) -> Dict[str, Any]:
+async def obter_localidades(agregado_id: int, nivel: str) -> Dict[str, Any]:
     """
     Obtém localidades disponíveis para um agregado em determinado nível geográfico.
     
@@ -435,7 +3603,7 @@ def obter_localidades(agregado_id: int, nivel: str) -> Dict[str, Any]:
         Lista de localidades disponíveis
     """
     try:
-        localidades = ibge_client.get_localidades(agregado_id, nivel)
+        localidades = await ibge_client.get_localidades_async(agregado_id, nivel)
         
         return {
             "status": "sucesso",
@@ -449,52 +3617,106 @@ def obter_localidades(agregado_id: int, nivel: str) -> Dict[str, Any]:
         return {"status": "erro", "mensagem": str(e)}
 
 @mcp.tool()
-def obter_periodos_agregado(agregado_id: int) -> Dict[str, Any]:
+async def obter_periodos_agregado(agregado_id: int, periodos: Optional[str] = None,
+                                  limite: int = 10) -> Dict[str, Any]:
     """
     Obtém todos os períodos disponíveis para um agregado.
     
     Args:
         agregado_id: ID do agregado
+        periodos: Expressão a resolver (ex: "-6", "2015-2020", "201701-201706|2019", "all");
+                  valida a expressão antes de usá-la em consultar_dados_variaveis
+        limite: Máximo de períodos listados (os mais recentes)
     
     Returns:
         Lista de períodos disponíveis com suas representações textuais
     """
     try:
-        periodos = ibge_client.get_periodos(agregado_id)
+        lista = await ibge_client.period_resolver.periodos(agregado_id)
+        if periodos:
+            ids = await ibge_client.period_resolver.resolve(agregado_id, periodos)
+            por_id = {str(p.get("id")): p for p in lista}
+            lista = [por_id.get(i, {"id": i}) for i in ids]
+        limite = max(1, limite)
         
         return {
             "status": "sucesso",
             "agregado_id": agregado_id,
-            "total_periodos": len(periodos),
-            "periodos": periodos[-10:] if len(periodos) > 10 else periodos,  # Mostrar últimos 10
-            "nota": "Apenas os últimos 10 períodos são mostrados" if len(periodos) > 10 else None
+            "expressao": periodos,
+            "total_periodos": len(lista),
+            "periodos_resolvidos": "|".join(str(p.get("id")) for p in lista) if periodos else None,
+            "periodos": lista[-limite:],  # Mostrar os mais recentes
+            "nota": f"Apenas os últimos {limite} períodos são mostrados" if len(lista) > limite else None
         }
     except Exception as e:
         return {"status": "erro", "mensagem": str(e)}
 
 @mcp.tool()
-def consultar_dados_variaveis(agregado_id: int,
+async def consultar_dados_variaveis(agregado_id: int,
                              variavel: str = "all",
                              localidades: str = "BR", 
                              periodos: Optional[str] = None,
                              classificacao: Optional[str] = None,
-                             view: str = "default") -> Dict[str, Any]:
+                             view: str = "default",
+                             pagina_tamanho: Optional[int] = None,
+                             cursor: Optional[str] = None,
+                             formato: str = "aninhado") -> Dict[str, Any]:
     """
     Consulta dados das variáveis de um agregado com filtros específicos.
     
+    Para consultas grandes (ex: todos os municípios em vários períodos), use
+    pagina_tamanho: a resposta é lida em streaming e apenas uma página de
+    séries é devolvida, com um "proximo_cursor" para buscar a seguinte.
+    
     Args:
         agregado_id: ID do agregado
         variavel: ID da variável ou "all" para todas (ex: "214|1982" para múltiplas)
         localidades: Localidades (ex: "BR", "N6[3550308]", "N7[3501,3301]") 
-        periodos: Períodos específicos (ex: "-6" para últimos 6, "201701-201706" para intervalo)
+        periodos: Períodos específicos (ex: "-6" para últimos 6, "201701-201706" para intervalo,
+                  "2019|2020" para lista, "all" para todos); resolvidos localmente em IDs
         classificacao: Classificações (ex: "226[4844]|218[4780]")
         view: Modo de visualização ("OLAP", "flat" ou "default")
+        pagina_tamanho: Número de séries (localidade × classificação) por página; páginas
+                        grandes são montadas com várias requisições à API
+        cursor: Cursor devolvido pela página anterior; substitui os demais filtros
+        formato: "aninhado" (padrão, como a API) ou "colunar" (colunas de códigos
+                 e dicionários de rótulos, bem mais compacto para muitas células)
     
     Returns:
         Dados das variáveis consultadas
     """
     try:
-        dados = ibge_client.get_variaveis(
+        if pagina_tamanho or cursor:
+            return await _consultar_dados_paginados(
+                agregado_id, variavel, localidades, periodos, classificacao, view,
+                pagina_tamanho, cursor
+            )
+
+        if formato == "colunar":
+            if view and view != "default":
+                raise Exception("O formato colunar só está disponível com view='default'")
+            tabela = await ibge_client.get_variaveis_table_async(
+                agregado_id=agregado_id,
+                variavel=variavel,
+                localidades=localidades,
+                periodos=periodos,
+                classificacao=classificacao,
+            )
+            return {
+                "status": "sucesso",
+                "agregado_id": agregado_id,
+                "parametros": {
+                    "variavel": variavel,
+                    "localidades": localidades,
+                    "periodos": periodos,
+                    "classificacao": classificacao,
+                },
+                "formato": "colunar",
+                "dados": tabela.to_dict(),
+                "observacao": "Colunas alinhadas por célula; 'valor' é nulo quando 'marcador' indica valor especial ('-' é guardado como 0)"
+            }
+
+        dados = await ibge_client.get_variaveis_async(
             agregado_id=agregado_id,
             variavel=variavel,
             localidades=localidades, 
@@ -520,52 +3742,249 @@ def consultar_dados_variaveis(agregado_id: int,
     except Exception as e:
         return {"status": "erro", "mensagem": str(e)}
 
+def _encode_cursor(estado: Dict[str, Any]) -> str:
+    payload = json.dumps(estado, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, TypeError):
+        raise Exception("Cursor de paginação inválido")
+
+
+async def _consultar_dados_paginados(agregado_id: int, variavel: str, localidades: str,
+                                     periodos: Optional[str], classificacao: Optional[str],
+                                     view: str, pagina_tamanho: Optional[int],
+                                     cursor: Optional[str]) -> Dict[str, Any]:
+    if cursor:
+        estado = _decode_cursor(cursor)
+    else:
+        if view and view != "default":
+            raise Exception("A paginação só está disponível com view='default'")
+        # Períodos relativos são fixados no cursor: as páginas seguintes não mudam
+        # de período se um novo for divulgado no meio da paginação
+        lista_periodos = await ibge_client.resolve_periodos_async(agregado_id, periodos)
+        if lista_periodos is not None:
+            periodos = "|".join(lista_periodos)
+        estado = {
+            "agregado_id": agregado_id,
+            "variavel": variavel,
+            "localidades": localidades,
+            "periodos": periodos,
+            "classificacao": classificacao,
+            "parte": 0,
+            "offset": 0,
+            "pagina_tamanho": pagina_tamanho,
+        }
+    tamanho = max(1, min(int(estado.get("pagina_tamanho") or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+    parte_inicial = parte = int(estado.get("parte", 0))
+    offset_inicial = offset = int(estado.get("offset", 0))
+
+    # A consulta é lida parte a parte, na ordem do plano (partes de até uma
+    # página, com no máximo MAX_LOCALIDADES_PER_REQUEST localidades); a página
+    # segue pelas partes seguintes até completar ``tamanho`` séries e o cursor
+    # guarda a parte atual e a posição dentro dela
+    partes = await ibge_client.plan_variaveis_async(
+        estado["agregado_id"], estado["variavel"], estado["localidades"],
+        estado["periodos"], estado["classificacao"], max_series=tamanho,
+    )
+    linhas: List[Dict[str, Any]] = []
+    proximo: Optional[Tuple[int, int]] = None
+    while parte < len(partes) and proximo is None:
+        chunk_periodos, chunk_localidades = partes[parte]
+        posicao = 0
+        stream = ibge_client.iter_variaveis_async(
+            agregado_id=estado["agregado_id"],
+            variavel=estado["variavel"],
+            localidades=chunk_localidades,
+            periodos=chunk_periodos,
+            classificacao=estado["classificacao"],
+        )
+        try:
+            async for linha in stream:
+                if len(linhas) >= tamanho:
+                    proximo = (parte, posicao)
+                    break
+                if posicao >= offset:
+                    linhas.append(linha)
+                posicao += 1
+        finally:
+            # Encerra a conexão assim que a página está completa
+            await stream.aclose()
+        if proximo is None:
+            parte, offset = parte + 1, 0
+            if len(linhas) >= tamanho and parte < len(partes):
+                proximo = (parte, 0)
+
+    proximo_cursor = None
+    if proximo is not None:
+        proximo_cursor = _encode_cursor({
+            **estado, "parte": proximo[0], "offset": proximo[1], "pagina_tamanho": tamanho,
+        })
+
+    return {
+        "status": "sucesso",
+        "agregado_id": estado["agregado_id"],
+        "parametros": {
+            "variavel": estado["variavel"],
+            "localidades": estado["localidades"],
+            "periodos": estado["periodos"],
+            "classificacao": estado["classificacao"],
+        },
+        "pagina": {
+            "parte": parte_inicial,
+            "total_partes": len(partes),
+            "offset": offset_inicial,
+            "pagina_tamanho": tamanho,
+            "series_na_pagina": len(linhas),
+            "proximo_cursor": proximo_cursor,
+        },
+        "dados": rows_to_variaveis(linhas),
+        "observacao": "Valores especiais: '-'=zero, '..'=não se aplica, '...'=não disponível, 'X'=omitido"
+    }
+
+
+@mcp.tool()
+async def agregar_dados_variaveis(agregado_id: int,
+                                  operacao: str = "soma",
+                                  agrupar_por: str = "variavel",
+                                  variavel: str = "all",
+                                  localidades: str = "BR",
+                                  periodos: Optional[str] = None,
+                                  classificacao: Optional[str] = None,
+                                  limite: int = 10,
+                                  ordem: str = "desc") -> Dict[str, Any]:
+    """
+    Agrega no servidor os dados das variáveis e devolve apenas o resultado compacto.
+    Evita trazer séries municipais inteiras só para somar, tirar médias ou rankear.
+    
+    Args:
+        agregado_id: ID do agregado
+        operacao: "soma", "media", "minimo", "maximo", "contagem" ou "crescimento"
+                  (variação % entre o primeiro e o último período de cada grupo)
+        agrupar_por: Dimensões separadas por vírgula entre "variavel", "categoria",
+                     "localidade" e "periodo" (ex: "localidade" para ranking de municípios)
+        variavel: ID da variável ou "all" (ex: "214|1982")
+        localidades: Localidades (ex: "N6[all]", "N2[35,33]")
+        periodos: Períodos (ex: "-6", "201701-201706")
+        classificacao: Classificações (ex: "226[4844]")
+        limite: Quantidade de grupos devolvidos (top-N)
+        ordem: "desc" (maiores primeiro) ou "asc"
+    
+    Returns:
+        Grupos agregados ordenados pelo valor, com contagem de valores especiais ignorados
+    """
+    try:
+        dimensoes = [d.strip() for d in re.split(r"[,|]", agrupar_por) if d.strip()]
+        VariaveisTable.validate_aggregation(dimensoes, operacao)
+        tabela = await ibge_client.get_variaveis_table_async(
+            agregado_id=agregado_id,
+            variavel=variavel,
+            localidades=localidades,
+            periodos=periodos,
+            classificacao=classificacao,
+        )
+        resultados, ignoradas = tabela.aggregate(dimensoes, operacao)
+
+        com_valor = [r for r in resultados if r["valor"] is not None]
+        com_valor.sort(key=lambda r: r["valor"], reverse=ordem != "asc")
+        resultados = com_valor + [r for r in resultados if r["valor"] is None]
+        if limite <= 0:
+            limite = 10
+
+        return {
+            "status": "sucesso",
+            "agregado_id": agregado_id,
+            "parametros": {
+                "variavel": variavel,
+                "localidades": localidades,
+                "periodos": periodos,
+                "classificacao": classificacao,
+            },
+            "operacao": operacao,
+            "agrupar_por": dimensoes,
+            "celulas_processadas": len(tabela),
+            "celulas_ignoradas": ignoradas,
+            "total_grupos": len(resultados),
+            "resultados": resultados[:limite],
+            "observacao": "'-' conta como zero; '..', '...' e 'X' são ignorados no cálculo"
+        }
+    except Exception as e:
+        return {"status": "erro", "mensagem": str(e)}
+
+
 @mcp.tool()
-def buscar_agregados_por_termo(termo: str, limite: int = 10) -> Dict[str, Any]:
+async def buscar_agregados_por_termo(termo: str = "",
+                                     limite: int = 10,
+                                     nivel: Optional[str] = None,
+                                     periodicidade: Optional[str] = None,
+                                     periodo_desde: Optional[int] = None,
+                                     periodo_ate: Optional[int] = None) -> Dict[str, Any]:
     """
     Busca agregados que contenham um termo específico no nome ou pesquisa.
+    Termos com várias palavras retornam os agregados que contêm todas elas.
+    Os resultados são ordenados por relevância (BM25), com peso maior para
+    ocorrências no nome do agregado e nas variáveis; cada um traz seu "score".
+    Os filtros opcionais são resolvidos localmente e podem ser combinados com
+    o termo (ex: tabelas municipais mensais sobre emprego desde 2020).
     
     Args:
-        termo: Termo a ser buscado (ex: "população", "inflação", "PIB")
+        termo: Termo a ser buscado (ex: "população", "inflação", "PIB");
+               pode ficar vazio se algum filtro for informado
         limite: Número máximo de resultados (padrão: 10)
+        nivel: Nível territorial disponível (ex: "N6"; "N3|N6" aceita qualquer um)
+        periodicidade: Frequência (ex: "mensal", "trimestral", "anual")
+        periodo_desde: Ano inicial; exige dados em algum ano a partir dele (ex: 2020)
+        periodo_ate: Ano final; exige dados em algum ano até ele
     
     Returns:
-        Lista de agregados encontrados
+        Lista de agregados encontrados; os já enriquecidos trazem um "resumo"
+        (periodicidade, níveis territoriais, variáveis e classificações com o
+        total de categorias), que costuma dispensar obter_metadados_agregado
     """
     try:
         if limite <= 0:
             limite = 10
 
-        todos_agregados = ibge_client.get_agregados()
-        resultados, stats = search_index.search(termo, todos_agregados, limite)
+        todos_agregados = await catalog_store.get()
+        filtros = {
+            "nivel": nivel,
+            "periodicidade": periodicidade,
+            "periodo_desde": periodo_desde,
+            "periodo_ate": periodo_ate,
+        }
+        filtros = {k: v for k, v in filtros.items() if v not in (None, "")}
+        if not termo.strip() and not filtros:
+            return {"status": "erro", "mensagem": "Informe um termo ou ao menos um filtro"}
+        candidatos = search_index.filter_ids(**filtros)
+        resultados, stats = search_index.search(termo, todos_agregados, limite, candidatos)
+        metadata_prefetcher.start()
 
         nota_partes: List[str] = []
-        if stats.get("metadata_fetches"):
+        if filtros and stats.get("pendencias_indice"):
             nota_partes.append(
-                f"Metadados adicionais carregados para {stats['metadata_fetches']} agregado(s) durante esta busca."
+                f"{stats['pendencias_indice']} agregado(s) ainda sem metadados não puderam ser avaliados pelos filtros."
             )
-        if (
-            stats.get("pendencias_indice")
-            and stats.get("metadata_fetches", 0) >= search_index.max_metadata_per_search
-        ):
+        if stats.get("pendencias_indice"):
             nota_partes.append(
-                "O índice ainda está sendo enriquecido; refaça a busca ou refine o termo para melhorar os resultados."
+                "O índice ainda está sendo enriquecido em segundo plano; refaça a busca mais tarde para resultados mais completos."
             )
-        if stats.get("metadata_errors"):
+        if metadata_prefetcher.errors:
             nota_partes.append(
-                f"Ocorreram {stats['metadata_errors']} erro(s) ao carregar metadados; consulte os logs para detalhes."
+                f"Ocorreram {metadata_prefetcher.errors} erro(s) ao carregar metadados; consulte os logs para detalhes."
             )
 
         return {
             "status": "sucesso",
             "termo_buscado": termo,
+            "filtros_aplicados": filtros or None,
             "total_encontrados": len(resultados),
             "limite_aplicado": limite,
             "resultados": resultados,
-            "indice": {
-                "pendencias_metadados": stats.get("pendencias_indice", 0),
-                "metadata_carregados": stats.get("metadata_fetches", 0),
-            },
+            "indice": metadata_prefetcher.status(),
             "nota": " ".join(nota_partes) if nota_partes else None
         }
     except Exception as e:
@@ -573,9 +3992,10 @@ def buscar_agregados_por_termo(termo: str, limite: int = 10) -> Dict[str, Any]:
 
 
 @mcp.tool()
-def buscar_localidades_por_nome(agregado_id: int, nivel: str, nome_localidade: str) -> Dict[str, Any]:
+async def buscar_localidades_por_nome(agregado_id: int, nivel: str, nome_localidade: str) -> Dict[str, Any]:
     """
     Busca localidades por nome dentro de um agregado e nível geográfico, tratando ambiguidades.
+    Aceita nomes sem acento, iniciais de palavras (ex: "sao jose") e pequenos erros de digitação.
 
     Args:
         agregado_id: ID do agregado para pesquisar as localidades.
@@ -586,18 +4006,15 @@ def buscar_localidades_por_nome(agregado_id: int, nivel: str, nome_localidade: s
         Dicionário com a lista de localidades correspondentes.
     """
     try:
-        todas_localidades = ibge_client.get_localidades(agregado_id, nivel)
-        
-        def normalizar(texto: str) -> str:
-            return ''.join(c for c in unicodedata.normalize('NFD', texto) if unicodedata.category(c) != 'Mn').lower()
+        correspondencias: List[Dict[str, Any]] = []
+        tipos: List[str] = []
+        for nivel_item in [n.strip() for n in nivel.split("|") if n.strip()]:
+            indice, ids_agregado = await gazetteer.ensure_nivel(agregado_id, nivel_item)
+            encontrados, tipo = gazetteer.lookup(indice, nome_localidade, ids_agregado)
+            if encontrados:
+                correspondencias.extend(encontrados)
+                tipos.append(tipo)
 
-        nome_normalizado = normalizar(nome_localidade)
-        
-        correspondencias = [
-            loc for loc in todas_localidades 
-            if nome_normalizado in normalizar(loc.get("nome", ""))
-        ]
-        
         if not correspondencias:
             return {
                 "status": "sucesso",
@@ -609,12 +4026,93 @@ def buscar_localidades_por_nome(agregado_id: int, nivel: str, nome_localidade: s
         return {
             "status": "sucesso",
             "total_encontrados": len(correspondencias),
+            "tipo_correspondencia": tipos[0] if len(set(tipos)) == 1 else tipos,
             "resultados": correspondencias
         }
     except Exception as e:
         return {"status": "erro", "mensagem": str(e)}
 
 
+@mcp.resource("mcp://ibge/cache")
+def cache_statistics() -> str:
+    """Estatísticas dos caches do servidor (acertos, falhas, despejos e ocupação)"""
+    return json_codec.dumps_text(ibge_client.cache_stats(), indent=True)
+
+
+def collect_metrics() -> Dict[str, Any]:
+    """Reúne métricas HTTP, de cache e de enriquecimento do índice"""
+    snapshot = ibge_client.metrics.snapshot()
+    snapshot["caches"] = ibge_client.cache_stats()
+    snapshot["circuitos"] = ibge_client.circuit_status()
+    snapshot["limitador"] = ibge_client.rate_limiter.stats()
+    snapshot["indice"] = {
+        **metadata_prefetcher.status(),
+        "agregados_indexados": len(search_index.index),
+    }
+    return snapshot
+
+
+def render_prometheus_metrics() -> str:
+    caches = ibge_client.cache_stats()
+    metadados = caches["metadados"]
+    status = metadata_prefetcher.status()
+    limiter = ibge_client.rate_limiter.stats()
+    return ibge_client.metrics.render_prometheus(
+        gauges={
+            "ibge_metadata_cache_bytes": metadados["bytes"],
+            "ibge_metadata_cache_entries": metadados["entradas"],
+            "ibge_rate_limiter_queue": limiter["fila"],
+            "ibge_index_agregados": len(search_index.index),
+            "ibge_index_pending_agregados": status["pendencias_metadados"],
+        },
+        counters={
+            "ibge_metadata_cache_hits_total": metadados["hits"],
+            "ibge_metadata_cache_misses_total": metadados["misses"],
+            "ibge_metadata_cache_evictions_total": metadados["despejos"],
+            "ibge_coalesced_requests_total": caches["requisicoes_agrupadas"],
+            "ibge_rate_limiter_wait_seconds_total": limiter["espera_total_s"],
+            "ibge_index_enriched_total": status["metadados_carregados"],
+            "ibge_index_errors_total": status["erros"],
+        },
+    )
+
+
+def start_metrics_http_server(port: int) -> None:
+    """Expõe /metrics em formato Prometheus numa thread separada"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render_prometheus_metrics().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug("metrics: " + format, *args)
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="ibge-metrics", daemon=True).start()
+    logger.info("Métricas Prometheus disponíveis em http://127.0.0.1:%s/metrics", port)
+
+
+@mcp.resource("mcp://ibge/metrics")
+def runtime_metrics() -> str:
+    """Métricas de execução: requisições, latência, bytes, erros, caches e índice"""
+    return json_codec.dumps_text(collect_metrics(), indent=True)
+
+
+@mcp.resource("mcp://ibge/metrics/prometheus")
+def runtime_metrics_prometheus() -> str:
+    """Métricas de execução no formato texto do Prometheus"""
+    return render_prometheus_metrics()
+
+
 @mcp.resource("mcp://ibge/help")
 def help_documentation() -> str:
     """Documentação de ajuda para usar o servidor MCP do IBGE"""
@@ -631,6 +4129,7 @@ Este servidor MCP fornece acesso simplificado aos dados estatísticos do IBGE.
 ### 2. obter_metadados_agregado  
 - Obtém metadados completos de um agregado
 - Parâmetro: agregado_id (obrigatório)
+- Para respostas menores: campos, categorias_de, max_categorias, resumo
 
 ### 3. obter_localidades
 - Lista localidades para um agregado e nível geográfico
@@ -638,20 +4137,31 @@ Este servidor MCP fornece acesso simplificado aos dados estatísticos do IBGE.
 
 ### 4. obter_periodos_agregado
 - Lista períodos disponíveis para um agregado
-- Parâmetro: agregado_id
+- Parâmetros: agregado_id, periodos (expressão a resolver, ex: "-6", "2015-2020"), limite
 
 ### 5. consultar_dados_variaveis
 - Consulta dados das variáveis com filtros
 - Parâmetros: agregado_id, variavel, localidades, periodos, classificacao
+- periodos aceita "-N" (últimos N), intervalos "inicio-fim", listas "a|b" e "all"
+- Consultas grandes: use pagina_tamanho e repita com o proximo_cursor retornado
 
 ### 6. buscar_agregados_por_termo
 - Busca agregados por termo no nome
 - Parâmetros: termo, limite
+- Filtros locais combináveis com o termo: nivel, periodicidade, periodo_desde, periodo_ate
 
 ### 7. buscar_localidades_por_nome
 - Busca IDs de localidades por nome, tratando ambiguidades.
 - Parâmetros: agregado_id, nivel, nome_localidade
 
+### 8. agregar_dados_variaveis
+- Soma, média, mínimo, máximo, contagem ou crescimento calculados no servidor
+- Parâmetros: agregado_id, operacao, agrupar_por, variavel, localidades, periodos, classificacao, limite, ordem
+
+### 9. obter_metadados_agregados
+- Metadados resumidos de vários agregados em uma única chamada (até 50)
+- Parâmetro: agregado_ids (ex: "1705,1712,5938")
+
 ## Exemplos de Uso:
 
 1. Buscar agregados sobre "população":
@@ -662,10 +4172,14 @@ Este servidor MCP fornece acesso simplificado aos dados estatísticos do IBGE.
 
 3. Obter metadados do agregado 1705:
    `obter_metadados_agregado(1705)`
+   ou de vários agregados de uma vez: `obter_metadados_agregados("1705,1712,5938")`
 
 4. Consultar dados do PIB para o Brasil nos últimos 6 períodos:
    `consultar_dados_variaveis(1705, "all", "BR", "-6")`
 
+5. Ranking dos 10 municípios com maior PIB no último período:
+   `agregar_dados_variaveis(5938, "soma", "localidade", "37", "N6[all]", limite=10)`
+
 ## Níveis Geográficos:
 - BR: Brasil
 - N1: Grandes Regiões  
@@ -682,13 +4196,18 @@ Este servidor MCP fornece acesso simplificado aos dados estatísticos do IBGE.
     return help_text
 
 if __name__ == "__main__":
+    configure_logging()
+
     # Executar servidor MCP
     print("Iniciando Servidor MCP para IBGE...")
     print("API Base:", BASE_URL)
-    print("Ferramentas disponíveis: 6")
+    print("Ferramentas disponíveis:", len(asyncio.run(mcp.list_tools())))
     print("Documentação: mcp://ibge/help")
     print("=" * 50)
 
+    if METRICS_PORT:
+        start_metrics_http_server(METRICS_PORT)
+
     try:
         mcp.run()
     except KeyboardInterrupt:
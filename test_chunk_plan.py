@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Testes da divisão de consultas no limite de valores da API
+==========================================================
+
+Verificam o plano de partes (períodos × localidades) de
+``_plan_variaveis_chunks`` com uma API simulada (httpx.MockTransport),
+sem acessar o IBGE.
+"""
+
+import asyncio
+import os
+import re
+
+os.environ.setdefault("IBGE_CACHE_PATH", "")
+
+import httpx
+
+import ibge_mcp_server as servidor
+
+MUNICIPIOS = [
+    {"id": str(3300000 + i), "nome": f"Município {i} - RJ", "nivel": {"id": "N6", "nome": "Município"}}
+    for i in range(1000)
+]
+PERIODOS = [{"id": str(ano), "literals": [str(ano)]} for ano in range(2010, 2023)]
+METADADOS = {
+    "id": 1705, "nome": "População residente por sexo",
+    "periodicidade": {"frequencia": "anual", "inicio": 2010, "fim": 2022},
+    "nivelTerritorial": {"Administrativo": ["N1", "N3", "N6"]},
+    "variaveis": [{"id": 93, "nome": "População residente", "unidade": "Pessoas"}],
+    "classificacoes": [{"id": 2, "nome": "Sexo", "categorias": [
+        {"id": 4, "nome": "Homens"}, {"id": 5, "nome": "Mulheres"},
+    ]}],
+}
+
+
+def _api(request):
+    caminho = request.url.path.replace("/api/v3", "")
+    if caminho.endswith("/metadados"):
+        return httpx.Response(200, json=[METADADOS])
+    if caminho.endswith("/periodos"):
+        return httpx.Response(200, json=PERIODOS)
+    if re.search(r"/localidades/N6$", caminho):
+        return httpx.Response(200, json=MUNICIPIOS)
+    return httpx.Response(404, json={"erro": caminho})
+
+
+def _planejar(localidades, periodos, classificacao=None):
+    async def executar():
+        cliente = servidor.IBGEAPIClient(transport=httpx.MockTransport(_api), cache_path=None)
+        try:
+            return await cliente._plan_variaveis_chunks(
+                1705, "93", localidades, periodos, classificacao
+            )
+        finally:
+            await cliente.aclose()
+
+    return asyncio.run(executar())
+
+
+def test_consulta_dentro_do_limite_nao_e_dividida():
+    assert _planejar("N6[all]", "2020|2021|2022", "2[all]") == []
+    assert _planejar("N6[N3[33]]", "-6") == []
+
+
+def test_nivel_inteiro_acima_do_limite_e_dividido_por_ids(monkeypatch):
+    monkeypatch.setattr(servidor, "MAX_VALUES_LIMIT", 300)
+    partes = _planejar("N6[all]", "2021|2022", "2[all]")
+
+    # 1000 municípios × 2 categorias por período: 150 municípios por parte
+    assert {periodo for periodo, _ in partes} == {"2021", "2022"}
+    for periodo in ("2021", "2022"):
+        ids = []
+        for parte_periodo, localidades in partes:
+            if parte_periodo != periodo:
+                continue
+            match = re.fullmatch(r"N6\[([\d,]+)\]", localidades)
+            assert match is not None
+            fatia = match.group(1).split(",")
+            assert len(fatia) * 2 <= servidor.MAX_VALUES_LIMIT
+            ids.extend(fatia)
+        assert ids == [m["id"] for m in MUNICIPIOS]
+
+
+def test_periodos_divididos_antes_das_localidades(monkeypatch):
+    monkeypatch.setattr(servidor, "MAX_VALUES_LIMIT", 5000)
+    partes = _planejar("N6[all]", "2015-2022", "2[all]")
+
+    # 2000 valores por período: dois períodos por parte, todas as localidades juntas
+    assert partes == [
+        ("2015|2016", "N6[all]"), ("2017|2018", "N6[all]"),
+        ("2019|2020", "N6[all]"), ("2021|2022", "N6[all]"),
+    ]
+
+
+def test_selecao_hierarquica_segue_inteira(monkeypatch):
+    monkeypatch.setattr(servidor, "MAX_VALUES_LIMIT", 300)
+    partes = _planejar("N6[N3[33]]|N6[3300001,3300002]", "2020|2021", "2[all]")
+
+    # O nível inteiro só dimensiona a consulta; a seleção nunca vira lista de IDs
+    assert partes == [
+        ("2020", "N6[N3[33]]"), ("2020", "N6[3300001,3300002]"),
+        ("2021", "N6[N3[33]]"), ("2021", "N6[3300001,3300002]"),
+    ]
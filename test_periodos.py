@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Testes da resolução de períodos e do cache por período
+======================================================
+
+Verificam a leitura das expressões de períodos, o PeriodResolver e o
+armazenamento de cada período sob a própria chave no cache persistente,
+com uma API simulada (httpx.MockTransport), sem acessar o IBGE.
+"""
+
+import asyncio
+import os
+import re
+import sqlite3
+
+os.environ.setdefault("IBGE_CACHE_PATH", "")
+
+import httpx
+import pytest
+
+import ibge_mcp_server as servidor
+
+MESES = [f"{ano}{mes:02d}" for ano in range(2016, 2020) for mes in range(1, 13)]
+LOCALIDADES = [
+    {"id": "3550308", "nome": "São Paulo - SP", "nivel": {"id": "N6", "nome": "Município"}},
+    {"id": "3304557", "nome": "Rio de Janeiro - RJ", "nivel": {"id": "N6", "nome": "Município"}},
+]
+METADADOS = {
+    "id": 1705, "nome": "População residente",
+    "periodicidade": {"frequencia": "anual", "inicio": 2010, "fim": 2022},
+    "nivelTerritorial": {"Administrativo": ["N1", "N6"]},
+    "variaveis": [{"id": 93, "nome": "População residente", "unidade": "Pessoas"}],
+    "classificacoes": [],
+}
+
+
+class APISimulada:
+    """API com lista de períodos mutável, que registra os caminhos pedidos"""
+
+    def __init__(self, periodos):
+        self.periodos = list(periodos)
+        self.caminhos = []
+
+    def __call__(self, request):
+        caminho = request.url.path.replace("/api/v3", "")
+        self.caminhos.append(caminho)
+        if caminho.endswith("/metadados"):
+            return httpx.Response(200, json=[METADADOS])
+        if caminho.endswith("/periodos"):
+            return httpx.Response(200, json=[{"id": p, "literals": [p]} for p in self.periodos])
+        match = re.fullmatch(r"/agregados/1705/periodos/([^/]+)/variaveis/93", caminho)
+        if match:
+            ids = re.findall(r"\d+", request.url.params["localidades"].split("[", 1)[1])
+            series = [
+                {"localidade": localidade, "serie": {p: str(int(p) + i) for p in match.group(1).split("|")}}
+                for i, localidade in enumerate(LOCALIDADES) if localidade["id"] in ids
+            ]
+            return httpx.Response(200, json=[{
+                "id": "93", "variavel": "População residente", "unidade": "Pessoas",
+                "resultados": [{"classificacoes": [], "series": series}],
+            }])
+        return httpx.Response(404, json={"erro": caminho})
+
+    def variaveis(self):
+        return [caminho for caminho in self.caminhos if caminho.endswith("/variaveis/93")]
+
+
+def _executar(api, corrotina, cache_path=None):
+    async def executar():
+        cliente = servidor.IBGEAPIClient(transport=httpx.MockTransport(api), cache_path=cache_path)
+        try:
+            return await corrotina(cliente)
+        finally:
+            await cliente.aclose()
+
+    return asyncio.run(executar())
+
+
+def _periodos_na_resposta(dados):
+    return sorted({
+        periodo
+        for linha in servidor.iter_variaveis_rows(dados)
+        for periodo in linha["serie"]["serie"]
+    })
+
+
+def test_expressoes_de_periodos():
+    assert servidor.parse_period_expression("-6") == [("ultimos", 6)]
+    assert servidor.parse_period_expression("201701-201706|2019, all") == [
+        ("intervalo", "201701", "201706"), ("periodo", "2019"), ("todos",),
+    ]
+    for invalida in ("", "-0", "2020-2019", "20a0", "ultimo"):
+        with pytest.raises(ValueError):
+            servidor.parse_period_expression(invalida)
+
+    # Granularidades diferentes são comparadas na menor em comum
+    assert servidor.period_in_range("201703", "2017", "2018")
+    assert servidor.period_in_range("2018", "201701", "201812")
+    assert not servidor.period_in_range("201901", "2017", "2018")
+    assert not servidor.period_in_range("2016", "201701", "201812")
+
+
+def test_resolver_com_periodos_mensais():
+    api = APISimulada(MESES)
+
+    async def resolver(cliente):
+        resolver = cliente.period_resolver
+        return (
+            await resolver.resolve(1705, "2017-2018"),
+            await resolver.resolve(1705, "-2|201601"),
+            await resolver.resolve(1705, None),
+            await resolver.resolve(1705, "205001"),
+        )
+
+    intervalo, combinada, padrao, explicito = _executar(api, resolver)
+    assert intervalo == [p for p in MESES if p.startswith(("2017", "2018"))]
+    assert combinada == ["201911", "201912", "201601"]
+    assert padrao == ["201912"]
+    # IDs explícitos seguem como estão, mesmo fora da lista
+    assert explicito == ["205001"]
+    assert api.caminhos.count("/agregados/1705/periodos") == 1
+
+    with pytest.raises(ValueError, match="Nenhum período"):
+        _executar(APISimulada(MESES), lambda cliente: cliente.period_resolver.resolve(1705, "2021-2022"))
+
+
+def test_periodos_recentes(monkeypatch):
+    monkeypatch.setattr(servidor, "RECENT_PERIODS", 2)
+    api = APISimulada([str(ano) for ano in range(2010, 2023)])
+
+    async def classificar(cliente):
+        resolver = cliente.period_resolver
+        # Sem a lista, a resposta é conservadora
+        antes = resolver.is_recent(1705, "2010")
+        await resolver.ids(1705)
+        return antes, [
+            resolver.is_recent(1705, expressao)
+            for expressao in ("2010|2015", "2021", "2022", "2023", "-1", "all", "2015-2021", "2010-2020")
+        ]
+
+    antes, depois = _executar(api, classificar)
+    assert antes is True
+    assert depois == [False, True, True, True, True, True, True, False]
+
+
+def test_nova_divulgacao_busca_so_o_novo_periodo(tmp_path, monkeypatch):
+    monkeypatch.setattr(servidor, "RECENT_PERIODS", 2)
+    cache_path = str(tmp_path / "cache.sqlite3")
+    api = APISimulada([str(ano) for ano in range(2010, 2023)])
+    localidades = "N6[3550308,3304557]"
+
+    async def consultar(cliente):
+        return await cliente.get_variaveis_async(1705, "93", localidades, "-6")
+
+    primeira = _executar(api, consultar, cache_path)
+    assert _periodos_na_resposta(primeira) == [str(ano) for ano in range(2017, 2023)]
+    assert api.variaveis() == ["/agregados/1705/periodos/2017|2018|2019|2020|2021|2022/variaveis/93"]
+
+    # Nova divulgação; a lista de períodos gravada já venceu
+    api.periodos.append("2023")
+    api.caminhos.clear()
+    with sqlite3.connect(cache_path) as conn:
+        conn.execute("UPDATE responses SET stored_at = stored_at - 3600 WHERE key LIKE '%/periodos'")
+    segunda = _executar(api, consultar, cache_path)
+    assert _periodos_na_resposta(segunda) == [str(ano) for ano in range(2018, 2024)]
+    assert api.variaveis() == ["/agregados/1705/periodos/2023/variaveis/93"]
+    assert segunda == servidor.merge_variaveis([
+        servidor.split_variaveis_por_periodo(primeira)[str(ano)] for ano in range(2018, 2023)
+    ] + [servidor.split_variaveis_por_periodo(segunda)["2023"]])
+
+    # Cada período fica sob a própria chave; os recentes quando gravados (2021 e
+    # 2022 na primeira consulta, 2023 na segunda) têm a validade curta
+    with sqlite3.connect(cache_path) as conn:
+        classes = {
+            re.search(r"/periodos/([^/]+)/", chave).group(1): (classe, expira - gravado)
+            for chave, classe, gravado, expira in conn.execute(
+                "SELECT key, endpoint_class, stored_at, expires_at FROM responses"
+                " WHERE key LIKE '%/variaveis/%'"
+            )
+        }
+    assert sorted(classes) == [str(ano) for ano in range(2017, 2024)]
+    for periodo, (classe, validade) in classes.items():
+        esperada = "variaveis_recentes" if periodo in ("2021", "2022", "2023") else "variaveis"
+        assert classe == esperada
+        assert validade == pytest.approx(servidor.CACHE_TTLS[esperada])
+
+
+def test_ids_explicitos_em_cache_nao_consultam_a_api(tmp_path):
+    cache_path = str(tmp_path / "cache.sqlite3")
+    api = APISimulada([str(ano) for ano in range(2010, 2023)])
+
+    async def consultar(cliente):
+        return await cliente.get_variaveis_async(1705, "93", "N6[3550308]", "2015|2016")
+
+    primeira = _executar(api, consultar, cache_path)
+    api.caminhos.clear()
+    # Novo processo: a lista de períodos vem do cache persistente
+    assert _executar(api, consultar, cache_path) == primeira
+    assert api.caminhos == []
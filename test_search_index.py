@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Testes do arquivo binário do índice de agregados
+================================================
+
+Verificam que o índice sobrevive a gravar → anexar → recarregar e à
+compactação do arquivo, sem acessar a API do IBGE.
+"""
+
+import asyncio
+import os
+
+os.environ.setdefault("IBGE_CACHE_PATH", "")
+
+import ibge_mcp_server as servidor
+
+CATALOGO = [
+    {"id": "1", "nome": "Censo Demográfico", "agregados": [
+        {"id": 1705, "nome": "População residente por sexo"},
+        {"id": 200, "nome": "Domicílios particulares permanentes"},
+    ]},
+    {"id": "2", "nome": "PIB dos Municípios", "agregados": [
+        {"id": 5938, "nome": "Produto interno bruto a preços correntes"},
+    ]},
+]
+
+METADADOS = {
+    1705: {
+        "id": 1705, "nome": "População residente por sexo", "pesquisa": "Censo Demográfico",
+        "assunto": "População", "periodicidade": {"frequencia": "anual", "inicio": 2000, "fim": 2022},
+        "nivelTerritorial": {"Administrativo": ["N1", "N6"]},
+        "variaveis": [{"id": 93, "nome": "População residente", "unidade": "Pessoas"}],
+        "classificacoes": [{"id": 2, "nome": "Sexo", "categorias": [
+            {"id": 4, "nome": "Homens"}, {"id": 5, "nome": "Mulheres"},
+        ]}],
+    },
+    5938: {
+        "id": 5938, "nome": "Produto interno bruto a preços correntes", "pesquisa": "PIB dos Municípios",
+        "assunto": "Contas nacionais", "periodicidade": {"frequencia": "anual", "inicio": 2002, "fim": 2021},
+        "nivelTerritorial": {"Administrativo": ["N1", "N2", "N6"]},
+        "variaveis": [{"id": 37, "nome": "Produto Interno Bruto", "unidade": "Mil Reais"}],
+        "classificacoes": [],
+    },
+}
+
+
+class ClienteMetadados:
+    """Fornece metadados fixos no lugar do IBGEAPIClient"""
+
+    async def get_agregado_metadados_async(self, agregado_id):
+        return METADADOS[agregado_id]
+
+
+def _estado(indice):
+    return {
+        agg_id: (
+            {campo: set(termos) for campo, termos in entrada["fields"].items() if termos},
+            entrada["metadata_loaded"],
+            entrada.get("resumo"),
+        )
+        for agg_id, entrada in indice.index.items()
+    }
+
+
+def _buscar(indice, termo):
+    resultados, _ = indice.search(termo, CATALOGO, 10)
+    return [(r["agregado_id"], r["score"], r.get("resumo")) for r in resultados]
+
+
+def test_gravar_anexar_recarregar(tmp_path):
+    arquivo = str(tmp_path / "indice.bin")
+    indice = servidor.AgregadoSearchIndex(ClienteMetadados(), cache_filename=arquivo)
+    indice.build_basic_index(CATALOGO)
+    indice.save()
+    tamanho_inicial = os.path.getsize(arquivo)
+
+    # Enriquecimento posterior é anexado ao arquivo existente
+    asyncio.run(indice.enrich_with_metadados("1705"))
+    indice.save()
+    asyncio.run(indice.enrich_with_metadados("5938"))
+    indice.save()
+    assert os.path.getsize(arquivo) > tamanho_inicial
+
+    recarregado = servidor.AgregadoSearchIndex(ClienteMetadados(), cache_filename=arquivo)
+    recarregado.ensure_loaded()
+    assert _estado(recarregado) == _estado(indice)
+    assert recarregado.pending_metadata_count() == indice.pending_metadata_count() == 1
+    for termo in ("populacao", "mulheres", "produto interno", "domicilios"):
+        assert _buscar(recarregado, termo) == _buscar(indice, termo)
+
+
+def test_compactacao_e_registro_truncado(tmp_path):
+    arquivo = str(tmp_path / "indice.bin")
+    indice = servidor.AgregadoSearchIndex(ClienteMetadados(), cache_filename=arquivo)
+    indice.build_basic_index(CATALOGO)
+    indice.save()
+    asyncio.run(indice.enrich_with_metadados("1705"))
+    indice.save()
+
+    # Regravação completa (compactação) preserva o conteúdo
+    indice._needs_rewrite = True
+    indice.save()
+    compactado = servidor.AgregadoSearchIndex(ClienteMetadados(), cache_filename=arquivo)
+    compactado.ensure_loaded()
+    assert _estado(compactado) == _estado(indice)
+
+    # Uma gravação interrompida no meio de um registro descarta só esse registro
+    asyncio.run(indice.enrich_with_metadados("5938"))
+    indice.save()
+    with open(arquivo, "r+b") as handle:
+        handle.truncate(os.path.getsize(arquivo) - 3)
+    truncado = servidor.AgregadoSearchIndex(ClienteMetadados(), cache_filename=arquivo)
+    truncado.ensure_loaded()
+    assert _estado(truncado)["1705"] == _estado(indice)["1705"]
+    assert truncado._needs_rewrite
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Testes do parser incremental de /variaveis
+==========================================
+
+Verificam que o VariaveisStreamParser devolve exatamente as mesmas linhas
+que a resposta decodificada de uma vez, qualquer que seja a divisão do
+corpo em pedaços, sem acessar a API do IBGE.
+"""
+
+import json
+import os
+import random
+
+os.environ.setdefault("IBGE_CACHE_PATH", "")
+
+import ibge_mcp_server as servidor
+
+
+def _resposta():
+    localidades = [
+        {"id": "3550308", "nivel": {"id": "N6", "nome": "Município"}, "nome": "São Paulo - SP"},
+        {"id": "3304557", "nivel": {"id": "N6", "nome": "Município"}, "nome": "Rio de Janeiro - RJ"},
+        {"id": "5300108", "nivel": {"id": "N6", "nome": "Município"}, "nome": "Brasília - DF \"capital\""},
+    ]
+    valores = ["123", "-", "..", "...", "X", "4.5", "ção\\/"]
+    dados = []
+    for variavel_id, nome in ((93, "População residente"), (1000093, "População — percentual")):
+        resultados = []
+        for categoria in ({"4": "Homens"}, {"5": "Mulheres"}, {}):
+            classificacoes = (
+                [{"id": "2", "nome": "Sexo", "categoria": categoria}] if categoria else []
+            )
+            resultados.append({
+                "classificacoes": classificacoes,
+                "series": [
+                    {
+                        "localidade": localidade,
+                        "serie": {
+                            str(ano): valores[(ano + i) % len(valores)]
+                            for ano in range(2018, 2023)
+                        },
+                    }
+                    for i, localidade in enumerate(localidades)
+                ],
+            })
+        dados.append({
+            "id": str(variavel_id),
+            "variavel": nome,
+            "unidade": "Pessoas",
+            "resultados": resultados,
+        })
+    return dados
+
+
+def _linhas_em_pedacos(corpo, tamanhos):
+    parser = servidor.VariaveisStreamParser()
+    linhas = []
+    posicao = 0
+    for tamanho in tamanhos:
+        linhas.extend(parser.feed(corpo[posicao:posicao + tamanho]))
+        posicao += tamanho
+    linhas.extend(parser.feed(corpo[posicao:]))
+    linhas.extend(parser.close())
+    return linhas
+
+
+def test_pedacos_aleatorios():
+    dados = _resposta()
+    esperado = list(servidor.iter_variaveis_rows(dados))
+    rng = random.Random(20240501)
+    for corpo in (
+        json.dumps(dados, ensure_ascii=False).encode("utf-8"),
+        json.dumps(dados, ensure_ascii=True, indent=2).encode("utf-8"),
+    ):
+        # Pedaços de 1 byte cortam caracteres UTF-8 multibyte e escapes ao meio
+        assert _linhas_em_pedacos(corpo, [1] * len(corpo)) == esperado
+        for _ in range(50):
+            tamanhos = [rng.randint(1, 64) for _ in range(len(corpo) // 8)]
+            assert _linhas_em_pedacos(corpo, tamanhos) == esperado
+
+
+def test_reagrupa_no_formato_original():
+    dados = _resposta()
+    corpo = json.dumps(dados).encode("utf-8")
+    linhas = _linhas_em_pedacos(corpo, [97] * (len(corpo) // 97))
+    assert len(linhas) == 2 * 3 * 3
+    assert servidor.rows_to_variaveis(linhas) == dados
+
+
+def test_resposta_vazia():
+    assert _linhas_em_pedacos(b"[]", [1]) == []